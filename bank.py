@@ -4,6 +4,9 @@ from datetime import datetime
 import re
 from typing import Dict
 
+from new_v.calculations import earning_expenses_by_period
+from new_v.data_processing import process_data
+from new_v.statement_cache import load_statement
 
 # from combine_dfs import combine_dfs_with_separation
 
@@ -25,98 +28,15 @@ def clean_text(text):
     return text
 
 
-def add_total_row(dataframe, sum_column):
-    total = round_numbers(dataframe[sum_column].sum())
-    total_transactions = dataframe['מספר טרנזקציות'].sum() if 'מספר טרנזקציות' in dataframe.columns else ''
-
-    total_data = {
-        column: ['סך הכל' if column == dataframe.columns[0] else
-                 total if column == sum_column else
-                 total_transactions if column == 'מספר טרנזקציות' else
-                 '']
-        for column in dataframe.columns
-    }
-
-    total_row = pd.DataFrame(
-        data=total_data,
-        index=[0],
-        columns=dataframe.columns,
-        dtype=object
-    )
-
-    # Ensure the total_row has the same dtypes as the original DataFrame
-    for column in dataframe.columns:
-        if column in ['מספר טרנזקציות', sum_column]:
-            total_row[column] = total_row[column].astype(dataframe[column].dtype)
-        else:
-            total_row[column] = total_row[column].astype(str)
-
-    return pd.concat([dataframe, total_row], ignore_index=True)
-
-
-def earning_expenses(initial_data) -> Dict[str, pd.DataFrame]:
-    earnings_data = initial_data[initial_data['זכות'].notna()].copy()
-    expenses_data = initial_data[initial_data['חובה'].notna()].copy()
-
-    # Function to format date range
-    def format_date_range(dates):
-        if len(dates) == 1:
-            return dates.iloc[0].strftime('%d/%m/%y')
-        else:
-            return f"{dates.min().strftime('%d/%m/%y')} - {dates.max().strftime('%d/%m/%y')}"
-
-    # Function to group by 'הפעולה' and 'פרטים' (long version)
-    def group_by_operation_and_details(data, amount_col):
-        data['פרטים'] = data['פרטים'].fillna('(ללא פרטים)')
-
-        grouped = data.groupby(['הפעולה', 'פרטים']).agg({
-            'תאריך': format_date_range,
-            amount_col: ['sum', 'count']
-        }).reset_index()
-
-        grouped.columns = ['הפעולה', 'פרטים', 'תאריך', amount_col, 'מספר טרנזקציות']
-        grouped['מספר טרנזקציות'] = grouped['מספר טרנזקציות'].astype(int)
-
-        column_order = ['הפעולה', 'פרטים', 'תאריך', 'מספר טרנזקציות', amount_col]
-        return grouped[column_order]
-
-    # Function to group by 'הפעולה' only (short version)
-    def group_by_operation(data, amount_col):
-        grouped = data.groupby('הפעולה').agg({
-            amount_col: 'sum',
-            'פרטים': lambda x: ', '.join(filter(None, set(clean_text(i) for i in x)))
-        }).reset_index()
-
-        return grouped
-
-    # Group earnings (long version)
-    l_earnings_grouped = group_by_operation_and_details(earnings_data, 'זכות')
-
-    # Group expenses (long version)
-    l_expenses_grouped = group_by_operation_and_details(expenses_data, 'חובה')
-
-    # Group earnings (short version)
-    s_earnings_grouped = group_by_operation(earnings_data, 'זכות')
-
-    # Group expenses (short version)
-    s_expenses_grouped = group_by_operation(expenses_data, 'חובה')
-
-    # Add sum rows
-    for df in [l_earnings_grouped, l_expenses_grouped, s_earnings_grouped, s_expenses_grouped]:
-        df = add_total_row(df, 'זכות' if 'זכות' in df.columns else 'חובה')
-
+def round_and_clean(dfs: Dict[str, pd.DataFrame]) -> Dict[str, pd.DataFrame]:
     # Round numbers and clean text
-    for data in [l_earnings_grouped, l_expenses_grouped, s_earnings_grouped, s_expenses_grouped]:
+    for data in dfs.values():
         for col in data.columns:
             if data[col].dtype in ['float64', 'int64']:
                 data[col] = data[col].apply(round_numbers)
             elif col == 'פרטים':
                 data[col] = data[col].apply(lambda x: clean_text(x) if x != '(ללא פרטים)' else x)
-
-    return {"s_earnings": s_earnings_grouped,
-            "s_expenses": s_expenses_grouped,
-            "l_earnings": l_earnings_grouped,
-            "l_expenses": l_expenses_grouped}
+    return dfs
 
 
 def get_date_input(prompt):
@@ -130,55 +50,42 @@ def get_date_input(prompt):
             print("Invalid date format. Please use DD/MM/YYYY or press Enter to skip.")
 
 
-# Read the Excel file
-data = pd.read_excel('bank.xlsx', header=None)
-
-# Find the first row that contains 'תאריך' (assuming this is the header row)
-header_row = data[data.eq('תאריך').any(axis=1)].index[0]
+def main():
+    # Read the Excel file, find the header row and parse the dates (cached until bank.xlsx changes)
+    data_cleaned = load_statement('bank.xlsx', process_data)
 
-# Select the data from the header row onwards
-data_cleaned = data.iloc[header_row:].reset_index(drop=True)
+    # Get user input for date range
+    start_date = get_date_input("Enter start date (DD/MM/YYYY) or press Enter for all dates: ")
+    end_date = get_date_input("Enter end date (DD/MM/YYYY) or press Enter for all dates: ")
 
-# Set the first row as the header
-data_cleaned.columns = data_cleaned.iloc[0]
-data_cleaned = data_cleaned[1:]
+    # If no dates are provided, use the earliest and latest dates from the data
+    if not start_date:
+        start_date = data_cleaned['תאריך'].min().date()
+    if not end_date:
+        end_date = data_cleaned['תאריך'].max().date()
 
-# Reset the index
-data_cleaned.reset_index(drop=True, inplace=True)
-# Convert the 'תאריך' column to datetime
-data_cleaned['תאריך'] = pd.to_datetime(data_cleaned['תאריך'])
+    # Filter the dataframe based on user input or data range
+    data_cleaned = data_cleaned[(data_cleaned['תאריך'].dt.date >= start_date) & (data_cleaned['תאריך'].dt.date <= end_date)]
 
-# Get user input for date range
-start_date = get_date_input("Enter start date (DD/MM/YYYY) or press Enter for all dates: ")
-end_date = get_date_input("Enter end date (DD/MM/YYYY) or press Enter for all dates: ")
+    # Create a folder to store the output files
+    output_folder = 'all_reports'
+    os.makedirs(output_folder, exist_ok=True)
 
-# If no dates are provided, use the earliest and latest dates from the data
-if not start_date:
-    start_date = data_cleaned['תאריך'].min().date()
-if not end_date:
-    end_date = data_cleaned['תאריך'].max().date()
+    # Group every transaction once; years and the full range are rolled up from the months
+    reports = earning_expenses_by_period(data_cleaned)
 
-# Filter the dataframe based on user input or data range
-data_cleaned = data_cleaned[(data_cleaned['תאריך'].dt.date >= start_date) & (data_cleaned['תאריך'].dt.date <= end_date)]
+    # Calculate for all dates
+    all_dates_dfs = round_and_clean(reports['all'])
+    date_range = f"{start_date.strftime('%d-%m-%Y')}_to_{end_date.strftime('%d-%m-%Y')}"
 
-# Create a folder to store the output files
-output_folder = 'all_reports'
-os.makedirs(output_folder, exist_ok=True)
+    all_dates_dfs["l_earnings"].to_csv(os.path.join(output_folder, f'earnings_{date_range}.csv'), index=False,
+                                       encoding='utf-8-sig')
+    all_dates_dfs["l_expenses"].to_csv(os.path.join(output_folder, f'expenses_{date_range}.csv'), index=False,
+                                       encoding='utf-8-sig')
 
-# Calculate for all dates
-all_dates_dfs = earning_expenses(data_cleaned)
-date_range = f"{start_date.strftime('%d-%m-%Y')}_to_{end_date.strftime('%d-%m-%Y')}"
-
-all_dates_dfs["l_earnings"].to_csv(os.path.join(output_folder, f'earnings_{date_range}.csv'), index=False,
-                                   encoding='utf-8-sig')
-all_dates_dfs["l_expenses"].to_csv(os.path.join(output_folder, f'expenses_{date_range}.csv'), index=False,
-                                   encoding='utf-8-sig')
-
-# Calculate for each year
-for year in range(data_cleaned['תאריך'].dt.year.min(), data_cleaned['תאריך'].dt.year.max() + 1):
-    year_data = data_cleaned[(data_cleaned['תאריך'].dt.year == year)]
-    if not year_data.empty:
-        year_dfs = earning_expenses(year_data)
+    # Calculate for each year
+    for year, year_dfs in reports['years'].items():
+        year_dfs = round_and_clean(year_dfs)
         year_folder = os.path.join(output_folder, str(year))
         os.makedirs(year_folder, exist_ok=True)
         year_dfs["l_earnings"].to_csv(os.path.join(year_folder, f'earnings_{year}.csv'), index=False,
@@ -186,20 +93,22 @@ for year in range(data_cleaned['תאריך'].dt.year.min(), data_cleaned['תאר
         year_dfs["l_expenses"].to_csv(os.path.join(year_folder, f'expenses_{year}.csv'), index=False,
                                       encoding='utf-8-sig')
 
-# Calculate for each month
-grouped = data_cleaned.groupby(data_cleaned['תאריך'].dt.to_period('M'))
+    # Calculate for each month
+    for month, monthly_dfs in reports['months'].items():
+        monthly_dfs = round_and_clean(monthly_dfs)
+
+        # Create a subfolder for each month
+        month_folder = os.path.join(output_folder, month.strftime('%Y-%m'))
+        os.makedirs(month_folder, exist_ok=True)
 
-for month, month_data in grouped:
-    monthly_dfs = earning_expenses(month_data)
+        # Export the grouped DataFrames to CSV files
+        monthly_dfs["l_earnings"].to_csv(os.path.join(month_folder, f'earnings_{month}.csv'), index=False,
+                                         encoding='utf-8-sig')
+        monthly_dfs["l_expenses"].to_csv(os.path.join(month_folder, f'expenses_{month}.csv'), index=False,
+                                         encoding='utf-8-sig')
 
-    # Create a subfolder for each month
-    month_folder = os.path.join(output_folder, month.strftime('%Y-%m'))
-    os.makedirs(month_folder, exist_ok=True)
+    print("All files have been exported successfully.")
 
-    # Export the grouped DataFrames to CSV files
-    monthly_dfs["l_earnings"].to_csv(os.path.join(month_folder, f'earnings_{month}.csv'), index=False,
-                                     encoding='utf-8-sig')
-    monthly_dfs["l_expenses"].to_csv(os.path.join(month_folder, f'expenses_{month}.csv'), index=False,
-                                     encoding='utf-8-sig')
 
-print("All files have been exported successfully.")
+if __name__ == "__main__":
+    main()
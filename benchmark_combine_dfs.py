@@ -0,0 +1,93 @@
+# benchmark_combine_dfs.py
+#
+# Times the block layout in combine_dfs.py against the previous concat-in-a-loop / iterrows implementation,
+# on hundreds of monthly-report-like frames. Run: python benchmark_combine_dfs.py [frames ...]
+
+import sys
+import time
+import numpy as np
+import pandas as pd
+from combine_dfs import _combine_horizontal, _combine_vertical
+
+OPERATIONS = ['כאל', 'bit העברת כסף', 'העב\' לאחר-נייד', 'הוראת-קבע', 'משיכה מבנקט', 'מטח-קניה',
+              'העברה מהבנק', 'ע.מפעולות-ישיר', 'מס הכנסה עצמאי', 'ביטוח לאומי']
+
+
+def make_report_frames(count: int, seed: int = 0) -> list:
+    """Frames shaped like the monthly long reports, 5-60 rows each."""
+    rng = np.random.default_rng(seed)
+    frames = []
+    for month in range(count):
+        rows = int(rng.integers(5, 61))
+        frames.append(pd.DataFrame({
+            'הפעולה': rng.choice(OPERATIONS, rows),
+            'פרטים': [f'לטובת: מוטב {i}' for i in rng.integers(0, 500, rows)],
+            'תאריך': [f'{day:02d}/{month % 12 + 1:02d}/24' for day in rng.integers(1, 29, rows)],
+            'מספר טרנזקציות': rng.integers(1, 10, rows),
+            'חובה': np.round(rng.gamma(2.0, 250.0, rows), 2),
+        }))
+    return frames
+
+
+# Previous implementation, kept verbatim as the baseline
+def legacy_combine_horizontal(df_list: list, num_columns: int) -> pd.DataFrame:
+    combined_df = pd.DataFrame()
+
+    for i, df in enumerate(df_list):
+        df = df.reset_index(drop=True)
+
+        for j in range(0, len(df.columns), num_columns):
+            column_slice = df.iloc[:, j:j + num_columns]
+            combined_df = pd.concat([combined_df, column_slice], axis=1)
+
+        if i < len(df_list) - 1:
+            empty_cols = pd.DataFrame('', index=df.index, columns=[f'Empty_{i + 1}_{k}' for k in range(1, 3)])
+            combined_df = pd.concat([combined_df, empty_cols], axis=1)
+
+    combined_df.columns = [col if not col.startswith('Empty_') else '' for col in combined_df.columns]
+    return combined_df
+
+
+def legacy_combine_vertical(df_list: list, num_rows: int) -> pd.DataFrame:
+    max_cols = max(len(df.columns) for df in df_list)
+    all_rows = []
+
+    for i, df in enumerate(df_list):
+        all_rows.append(df.columns.tolist() + [''] * (max_cols - len(df.columns)))
+
+        for _, row in df.iterrows():
+            all_rows.append(row.tolist() + [''] * (max_cols - len(df.columns)))
+
+        if i < len(df_list) - 1:
+            all_rows.extend([[''] * max_cols] * 2)
+
+    return pd.DataFrame(all_rows)
+
+
+def best_time(func, frames: list, size: int, repeat: int = 3):
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(frames, size)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or [100, 300, 1000]
+    benchmarks = [('horizontal', legacy_combine_horizontal, _combine_horizontal),
+                  ('vertical', legacy_combine_vertical, _combine_vertical)]
+    print(f"{'frames':>8}  {'layout':<12}{'legacy s':>10}{'block s':>10}{'speedup':>9}")
+    for count in counts:
+        frames = make_report_frames(count)
+        # A frame of only numbers takes iterrows' upcasting path
+        frames[0] = frames[0][['מספר טרנזקציות', 'חובה']]
+        for name, legacy, current in benchmarks:
+            legacy_time, legacy_result = best_time(legacy, frames, 5)
+            current_time, current_result = best_time(current, frames, 5)
+            pd.testing.assert_frame_equal(legacy_result, current_result)
+            print(f"{count:>8}  {name:<12}{legacy_time:>10.3f}{current_time:>10.3f}{legacy_time / current_time:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
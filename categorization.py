@@ -0,0 +1,456 @@
+# Expense categorization, whichever backend answers: one shared result cache, the offline layers in
+# front of it (merchant index, local classifier) and budgeted, batched requests to a Provider.
+
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from category_store import CategoryStore
+from merchant_index import MerchantIndex
+from local_classifier import LocalClassifier
+
+try:
+    from instrumentation import instrumented, record_api_call
+except ImportError:  # run from this folder, where new_v is a package
+    from new_v.instrumentation import instrumented, record_api_call
+
+EXPENSE_CATEGORIES = [
+    "Shopping", "Groceries", "Utilities", "Transportation", "Travel",
+    "Dining Out", "Online Services", "Healthcare", "Education", "Entertainment",
+    "Home Maintenance", "Personal Care", "Gifts & Donations", "Insurance",
+    "Taxes", "Debt Payments", "Savings & Investments", "Business Expenses",
+    "Pet Care", "Other"
+]
+
+# Every provider reads and writes this cache, so a business is only ever categorized once
+TRANSACTION_KIND_FILE = 'transaction_kind.json'
+# Per-provider caches from before it was shared; their entries are merged into it
+LEGACY_CACHE_FILES = {'gemini': 'transaction_kind_g.json'}
+# Provider used when none is given: a name, or names joined by '+' to race them (e.g. 'claude+gemini')
+DEFAULT_PROVIDER = os.environ.get('CATEGORIZATION_PROVIDER', 'claude')
+
+MAX_PARSE_RETRIES = 2
+DEFAULT_MAX_RESPONSE_TOKENS = 4096
+DEFAULT_MAX_BATCH_SIZE = 60
+# Batches are packed to this share of max_tokens, leaving room for answers longer than estimated
+RESPONSE_HEADROOM = 0.75
+# Starting token estimates (instructions, categories and tool schema; each answer's category, confidence
+# and explanation), corrected by the usage the API reports
+PROMPT_OVERHEAD_TOKENS = 700
+RESPONSE_OVERHEAD_TOKENS = 40
+RESPONSE_TOKENS_PER_BUSINESS = 50
+# Weight of the latest response when recalibrating the estimates
+CALIBRATION_WEIGHT = 0.3
+
+
+def load_known_transactions(path=TRANSACTION_KIND_FILE):
+    store = CategoryStore(path)
+    if path == TRANSACTION_KIND_FILE:
+        merge_legacy_caches(store)
+    return store
+
+
+def merge_legacy_caches(store):
+    """Add the entries of LEGACY_CACHE_FILES missing from the shared cache, marked with the provider that made them."""
+    for provider, path in LEGACY_CACHE_FILES.items():
+        if not os.path.exists(path):
+            continue
+        legacy = CategoryStore(path).categories
+        missing = {name: {'provider': provider, **value} for name, value in legacy.items() if name not in store}
+        if missing:
+            store.update(missing)
+            print(f"Merged {len(missing)} {provider} categorizations from {path} into the shared cache")
+
+
+class Provider:
+    """A categorization backend. Subclasses implement request(); callers use categorize().
+
+    request(businesses, max_tokens, usage) categorizes one batch: it returns {name: entry} for the
+    names it could categorize, or None if the request failed, and fills usage with the response's
+    input_tokens, output_tokens and stop_reason when the backend reports them. A provider is used as
+    a context manager around a run, so backends can hold connections open between batches.
+    """
+
+    name = 'provider'
+    max_concurrency = 4
+    max_response_tokens = DEFAULT_MAX_RESPONSE_TOKENS
+    max_batch_size = DEFAULT_MAX_BATCH_SIZE
+    input_cost_per_mtok = 0.0
+    output_cost_per_mtok = 0.0
+    # Default per-run limits on the tokens and dollars spent through this provider; 0 means no limit
+    token_budget = 0
+    cost_budget = 0
+
+    def categorize(self, businesses, max_tokens, usage):
+        """request(), with every entry marked with the provider and time that categorized it."""
+        results = self.request(businesses, max_tokens, usage)
+        if results is None:
+            return None
+        categorized_at = datetime.now().isoformat(timespec='seconds')
+        for entry in results.values():
+            entry.setdefault('provider', self.name)
+            entry.setdefault('categorized_at', categorized_at)
+        return results
+
+    def request(self, businesses, max_tokens, usage):
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class MockProvider(Provider):
+    """Deterministic offline provider for tests and load tests.
+
+    A business always gets the same category and confidence (from a hash of its name and the seed),
+    and a response reports the token usage TokenBudget estimates for it, cut off like the API's
+    when it exceeds max_tokens. latency adds a simulated round trip, up to jitter longer; a
+    failure_rate share of batches fails and a drop_rate share of businesses is left out of the
+    first answer that includes them, both chosen by hash so runs repeat exactly.
+    """
+
+    name = 'mock'
+    max_concurrency = 8
+
+    def __init__(self, latency=0.0, jitter=0.0, failure_rate=0.0, drop_rate=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.drop_rate = drop_rate
+        self.seed = seed
+        self.requested = Counter()
+        self.lock = threading.Lock()
+
+    def request(self, businesses, max_tokens, usage):
+        start = time.perf_counter()
+        batch_key = '\n'.join(businesses)
+        time.sleep(self.latency + self.jitter * self.fraction('latency', batch_key))
+        if self.fraction('failure', batch_key) < self.failure_rate:
+            record_api_call(self.name, time.perf_counter() - start, 500)
+            return None
+        with self.lock:
+            attempts = {name: self.requested[name] for name in businesses}
+            self.requested.update(businesses)
+
+        results = {}
+        input_tokens, output_tokens = PROMPT_OVERHEAD_TOKENS, RESPONSE_OVERHEAD_TOKENS
+        stop_reason = 'end_turn'
+        for name in businesses:
+            input_tokens += estimate_tokens(name) + 2
+            if not attempts[name] and self.fraction('drop', name) < self.drop_rate:
+                continue
+            answer_tokens = estimate_tokens(name) + RESPONSE_TOKENS_PER_BUSINESS
+            if output_tokens + answer_tokens > max_tokens:
+                output_tokens, stop_reason = max_tokens, 'max_tokens'
+                break
+            output_tokens += answer_tokens
+            results[name] = {
+                'category': EXPENSE_CATEGORIES[int(self.fraction('category', name) * len(EXPENSE_CATEGORIES))],
+                'confidence': f"{50 + int(self.fraction('confidence', name) * 50)}%",
+                'explanation': 'Categorized by the mock provider',
+            }
+        usage.update(input_tokens=input_tokens, output_tokens=output_tokens, stop_reason=stop_reason)
+        record_api_call(self.name, time.perf_counter() - start, 200)
+        return results
+
+    def fraction(self, purpose, key):
+        """A number in [0, 1) that depends only on the seed, the purpose and the key."""
+        digest = hashlib.sha1(f'{self.seed}:{purpose}:{key}'.encode('utf-8')).digest()
+        return int.from_bytes(digest[:8], 'big') / 2 ** 64
+
+
+class RacingProvider(Provider):
+    """Sends each batch to several providers and keeps the first valid answer (not None, not empty).
+
+    With hedge_after, the next provider only starts once no valid answer came within that many
+    seconds, which trims the tail latency for the price of some duplicate requests; without it, all
+    start at once. Only the winning answer's usage reaches the budget, although the other requests
+    are paid for as well.
+    """
+
+    def __init__(self, providers, hedge_after=None):
+        self.providers = list(providers)
+        self.hedge_after = hedge_after
+        self.name = '+'.join(provider.name for provider in self.providers)
+        self.max_concurrency = min(provider.max_concurrency for provider in self.providers)
+        self.max_response_tokens = min(provider.max_response_tokens for provider in self.providers)
+        self.max_batch_size = min(provider.max_batch_size for provider in self.providers)
+        self.input_cost_per_mtok = max(provider.input_cost_per_mtok for provider in self.providers)
+        self.output_cost_per_mtok = max(provider.output_cost_per_mtok for provider in self.providers)
+        self.token_budget = min((provider.token_budget for provider in self.providers if provider.token_budget), default=0)
+        self.cost_budget = min((provider.cost_budget for provider in self.providers if provider.cost_budget), default=0)
+        self.wins = Counter()
+        self.pool = None
+
+    def request(self, businesses, max_tokens, usage):
+        waiting, running = list(self.providers), {}
+        while waiting or running:
+            if waiting:
+                provider = waiting.pop(0)
+                provider_usage = {}
+                running[self.pool.submit(provider.categorize, businesses, max_tokens, provider_usage)] = \
+                    (provider, provider_usage)
+            # Without hedge_after the next provider starts right away; when none is left, wait for an answer
+            timeout = (self.hedge_after or 0) if waiting else None
+            finished, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in finished:
+                provider, provider_usage = running.pop(future)
+                if future.exception() is not None:
+                    print(f"{provider.name} failed: {future.exception()}")
+                elif future.result():
+                    self.wins[provider.name] += 1
+                    usage.update(provider_usage)
+                    return future.result()
+        return None
+
+    def __enter__(self):
+        for provider in self.providers:
+            provider.__enter__()
+        self.pool = ThreadPoolExecutor(max_workers=sum(provider.max_concurrency for provider in self.providers))
+        return self
+
+    def __exit__(self, *exc_info):
+        # Requests that lost their race are left to finish; their answers are dropped
+        self.pool.shutdown(wait=True)
+        for provider in self.providers:
+            provider.__exit__(*exc_info)
+        print(f"Race wins: {', '.join(f'{name} {count}' for name, count in self.wins.most_common())}")
+
+
+def make_provider(spec=DEFAULT_PROVIDER, hedge_after=None):
+    """The provider named by spec ('claude', 'gemini' or 'mock'), or a RacingProvider for names joined by '+'."""
+    providers = [load_provider(name.strip()) for name in spec.split('+')]
+    return providers[0] if len(providers) == 1 else RacingProvider(providers, hedge_after)
+
+
+def load_provider(name):
+    # The API modules read their config and import requests, so they're only loaded when used
+    if name == 'claude':
+        from claude_api import ClaudeProvider
+        return ClaudeProvider()
+    if name == 'gemini':
+        from gemini_api import GeminiProvider
+        return GeminiProvider()
+    if name == 'mock':
+        return MockProvider()
+    raise ValueError(f"Unknown categorization provider '{name}', expected claude, gemini or mock")
+
+
+@instrumented()
+def categorize_expenses(businesses_names, provider=None, max_concurrency=None, fuzzy_match=True, local_model=True,
+                        budget=None, cache_path=TRANSACTION_KIND_FILE):
+    """Categorize the businesses, from the shared cache where possible, and return {name: entry} in their order.
+
+    Names not in the cache go through the merchant index and the local classifier first; only the
+    rest are sent to the provider (by default make_provider()), in batches sized and limited by the
+    budget, and every answer is appended to the cache as it arrives.
+    """
+    known_transactions = load_known_transactions(cache_path)
+    uncategorized = list(dict.fromkeys(b for b in businesses_names if b not in known_transactions))
+
+    if fuzzy_match and uncategorized:
+        # Variants of merchants we already trust (other branches, terminal IDs) reuse their category offline
+        index = MerchantIndex(known_transactions.categories)
+        inherited = {b: match for b in uncategorized if (match := index.lookup(b))}
+        known_transactions.update(inherited)
+        uncategorized = [b for b in uncategorized if b not in inherited]
+        stats = index.stats()
+        print(f"Merchant index: {stats['hits']}/{stats['lookups']} names matched offline "
+              f"({stats['hit_rate']:.0%}, {stats['by_match']})")
+
+    if local_model and uncategorized:
+        # Only names the offline model is unsure about go to the API
+        predicted = LocalClassifier.train(known_transactions.categories).categorize(uncategorized)
+        known_transactions.update(predicted)
+        print(f"Local classifier: {len(predicted)}/{len(uncategorized)} names categorized offline")
+        uncategorized = [b for b in uncategorized if b not in predicted]
+
+    if uncategorized:
+        provider = provider or make_provider()
+        max_concurrency = max_concurrency or provider.max_concurrency
+        budget = budget or TokenBudget.for_provider(provider)
+        queue, running, done = uncategorized, set(), 0
+        with provider, ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+            while queue or running:
+                # Batches are packed as requests finish, so each is sized by the usage seen so far
+                while queue and len(running) < max_concurrency:
+                    batch = budget.pack(queue)
+                    if not batch:
+                        break
+                    queue = queue[len(batch):]
+                    running.add(pool.submit(categorize_batch, provider, batch, budget))
+                if not running:
+                    break
+                finished, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    batch_results = future.result()
+                    # Appends just this batch to the store's log instead of rewriting the whole file
+                    known_transactions.update(batch_results)
+                    done += 1
+                    print(f"Categorized batch {done} ({len(batch_results)} businesses, {len(queue)} waiting)")
+        known_transactions.compact()
+        print(budget.report())
+        if budget.exhausted:
+            left = sum(1 for b in uncategorized if b not in known_transactions)
+            print(f"Token budget reached: {left} businesses left uncategorized until the next run")
+
+    # Results follow the order of the input names, however the batches finished
+    return {b: known_transactions[b] for b in businesses_names if b in known_transactions}
+
+
+def categorize_batch(provider, businesses, budget=None):
+    """Categorize one batch; businesses missing from a response are re-requested on their own.
+
+    Every request is sized and allowed by the budget, so a re-request that no longer fits one
+    response is split, and requests stop once the budget is spent.
+    """
+    budget = budget or TokenBudget.for_provider(provider)
+    results = {}
+    pending = list(businesses)
+    for attempt in range(MAX_PARSE_RETRIES + 1):
+        if attempt:
+            print(f"Retrying {len(pending)} businesses missing from the response")
+        remaining = pending
+        while remaining:
+            batch, reservation = budget.next_batch(remaining)
+            if not batch:
+                return results
+            remaining = remaining[len(batch):]
+            usage = {}
+            batch_results = provider.categorize(batch, budget.max_response_tokens, usage)
+            budget.record(reservation, usage, len(batch_results or {}))
+            if batch_results is None:
+                return results
+            results.update(batch_results)
+        pending = [b for b in pending if b not in results]
+        if not pending:
+            break
+    return results
+
+
+def estimate_tokens(text):
+    """Rough token count: about 4 characters per token for ASCII, fewer for Hebrew and other scripts."""
+    ascii_chars = sum(1 for c in text if c.isascii())
+    return max(1, math.ceil(ascii_chars / 4 + (len(text) - ascii_chars) / 1.5))
+
+
+class TokenBudget:
+    """Token and cost accounting for one categorization run, which also sizes its batches.
+
+    The prompt and response tokens of a batch are estimated per business from its name, scaled by
+    how far off the estimates were for the responses so far, and a batch gets as many businesses as
+    fit RESPONSE_HEADROOM of max_response_tokens. A request is only made while its estimate fits the
+    remaining max_tokens and max_cost (0 = no limit); estimates of requests in flight count against
+    them, so concurrent requests overshoot the limits by no more than the estimates' error.
+    """
+
+    def __init__(self, max_tokens=0, max_cost=0, max_response_tokens=DEFAULT_MAX_RESPONSE_TOKENS,
+                 max_batch_size=DEFAULT_MAX_BATCH_SIZE, input_cost_per_mtok=0.0, output_cost_per_mtok=0.0):
+        self.max_tokens = max_tokens
+        self.max_cost = max_cost
+        self.max_response_tokens = max_response_tokens
+        self.max_batch_size = max_batch_size
+        self.input_cost_per_mtok = input_cost_per_mtok
+        self.output_cost_per_mtok = output_cost_per_mtok
+        self.prompt_scale = 1.0
+        self.response_scale = 1.0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.reserved_tokens = 0
+        self.reserved_cost = 0.0
+        self.requests = 0
+        self.truncated = 0
+        self.categorized = 0
+        self.exhausted = False
+        self.lock = threading.Lock()
+
+    @classmethod
+    def for_provider(cls, provider):
+        """A budget with the provider's limits, response size and prices."""
+        return cls(provider.token_budget, provider.cost_budget, provider.max_response_tokens, provider.max_batch_size,
+                   provider.input_cost_per_mtok, provider.output_cost_per_mtok)
+
+    @property
+    def cost(self):
+        return self.token_cost(self.input_tokens, self.output_tokens)
+
+    def token_cost(self, input_tokens, output_tokens):
+        return (input_tokens * self.input_cost_per_mtok + output_tokens * self.output_cost_per_mtok) / 1e6
+
+    def pack(self, businesses):
+        """The longest prefix of businesses that fits one request and the remaining budget; empty once it's spent."""
+        with self.lock:
+            return businesses[:self._pack(businesses)[0]]
+
+    def next_batch(self, businesses):
+        """Like pack, but also reserves the batch's estimate until record() reports its actual usage."""
+        with self.lock:
+            size, prompt, response = self._pack(businesses)
+            reservation = {'prompt': prompt, 'response': response,
+                           'tokens': prompt * self.prompt_scale + response * self.response_scale,
+                           'cost': self.token_cost(prompt * self.prompt_scale, response * self.response_scale)}
+            if size:
+                self.reserved_tokens += reservation['tokens']
+                self.reserved_cost += reservation['cost']
+            return businesses[:size], reservation
+
+    def record(self, reservation, usage, categorized):
+        """Account for a request's usage ({} if it failed) and recalibrate the estimates from it."""
+        with self.lock:
+            self.reserved_tokens -= reservation['tokens']
+            self.reserved_cost -= reservation['cost']
+            if 'input_tokens' not in usage:
+                return
+            input_tokens, output_tokens = usage.get('input_tokens', 0), usage.get('output_tokens', 0)
+            self.requests += 1
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+            self.categorized += categorized
+            self.prompt_scale = calibrate(self.prompt_scale, input_tokens / reservation['prompt'])
+            response_ratio = output_tokens / reservation['response']
+            if usage.get('stop_reason') == 'max_tokens':
+                # A cut-off answer only shows a lower bound, so grow the estimate at least by half
+                self.truncated += 1
+                self.response_scale = max(self.response_scale * 1.5, response_ratio)
+            else:
+                self.response_scale = calibrate(self.response_scale, response_ratio)
+
+    def report(self):
+        per_business = (self.input_tokens + self.output_tokens) / self.categorized if self.categorized else 0
+        return (f"Categorization used {self.input_tokens} input + {self.output_tokens} output tokens in "
+                f"{self.requests} requests (${self.cost:.4f}): {per_business:.0f} tokens per categorized business"
+                + (f", {self.truncated} responses cut off at max_tokens" if self.truncated else ""))
+
+    def _pack(self, businesses):
+        # Unscaled estimates of the batch so far; a single business always fits the response target
+        prompt, response = PROMPT_OVERHEAD_TOKENS, RESPONSE_OVERHEAD_TOKENS
+        target = self.max_response_tokens * RESPONSE_HEADROOM
+        size = 0
+        for name in businesses[:self.max_batch_size]:
+            name_tokens = estimate_tokens(name)
+            # The prompt lists the name as a JSON string; the answer repeats it next to its category
+            next_prompt, next_response = prompt + name_tokens + 2, response + name_tokens + RESPONSE_TOKENS_PER_BUSINESS
+            if size and next_response * self.response_scale > target:
+                break
+            if not self._affordable(next_prompt * self.prompt_scale, next_response * self.response_scale):
+                self.exhausted = True
+                break
+            prompt, response = next_prompt, next_response
+            size += 1
+        return size, prompt, response
+
+    def _affordable(self, prompt_tokens, response_tokens):
+        tokens = self.input_tokens + self.output_tokens + self.reserved_tokens + prompt_tokens + response_tokens
+        cost = self.cost + self.reserved_cost + self.token_cost(prompt_tokens, response_tokens)
+        return (not self.max_tokens or tokens <= self.max_tokens) and (not self.max_cost or cost <= self.max_cost)
+
+
+def calibrate(scale, ratio):
+    return (1 - CALIBRATION_WEIGHT) * scale + CALIBRATION_WEIGHT * ratio
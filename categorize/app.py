@@ -1,6 +1,17 @@
 from flask import Flask, render_template, request, jsonify
+import atexit
+import base64
+import hashlib
 import json
-import csv
+import os
+import sys
+import threading
+from transaction_index import TransactionIndex
+
+# The category store is shared with the categorization scripts in the parent folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from category_store import CategoryStore
+from merchant_index import confidence_value
 
 EXPENSE_CATEGORIES = [
     "Shopping", "Groceries", "Utilities", "Transportation", "Travel",
@@ -10,7 +21,79 @@ EXPENSE_CATEGORIES = [
     "Pet Care", "Other"
 ]
 
+DETAILS_PAGE_SIZE = 50
+CATEGORIZE_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Types of each sort order's key, which a cursor's resume position must match
+SORT_ORDERS = {'spend': ('number', 'text'), 'confidence': ('number', 'text'), 'name': ('text',)}
+FLUSH_DELAY = 2.0  # seconds without edits before the snapshot is rewritten
+EDITABLE_FIELDS = {'category', 'confidence', 'explanation', 'confirm'}
+CHANGES_EXPECTED = 'expected a JSON object of {business name: fields}'
+
 app = Flask(__name__)
+transactions = TransactionIndex('../cal_cleaned.csv')
+
+# Each edit is appended (and fsynced) to the store's log right away; rewriting transaction_kind.json is
+# debounced to a background timer. The store reloads when the categorization scripts write to it too.
+categories = CategoryStore('../transaction_kind.json')
+store_lock = threading.Lock()
+flush_timer = None
+# Bumped on every edit; with the statement file's signature it identifies what a GET can return
+store_version = 0
+STARTED = os.urandom(8).hex()
+
+
+def schedule_flush():
+    global flush_timer
+    if flush_timer is not None:
+        flush_timer.cancel()
+    flush_timer = threading.Timer(FLUSH_DELAY, flush_categories)
+    flush_timer.daemon = True
+    flush_timer.start()
+
+
+def flush_categories():
+    with store_lock:
+        # Merges what other processes wrote since the last refresh into the new snapshot
+        categories.compact()
+
+
+def refresh_categories():
+    """Pick up categorizations other processes wrote since the store was last read. Call with store_lock held."""
+    global store_version
+    if categories.refresh():
+        store_version += 1
+
+
+atexit.register(flush_categories)
+
+
+def apply_changes(changes):
+    """Merge {business name: partial entry} into the store. Returns (updated entries, errors)."""
+    global store_version
+    updated, errors = {}, {}
+    with store_lock:
+        refresh_categories()
+        for business_name, fields in changes.items():
+            if business_name not in categories:
+                errors[business_name] = 'unknown business'
+                continue
+            if not isinstance(fields, dict):
+                errors[business_name] = 'expected an object of fields'
+                continue
+            if 'category' in fields and fields['category'] not in EXPENSE_CATEGORIES:
+                errors[business_name] = f"unknown category {fields['category']!r}"
+                continue
+            value = dict(categories[business_name])
+            value.update({k: v for k, v in fields.items() if k in EDITABLE_FIELDS})
+            if value.get('confirm'):
+                value['confidence'] = '100%'
+            updated[business_name] = value
+        categories.update(updated)
+        store_version += bool(updated)
+    if updated:
+        schedule_flush()
+    return updated, errors
 
 @app.route('/')
 def index():
@@ -19,29 +102,137 @@ def index():
 @app.route('/categorize', methods=['GET', 'POST'])
 def categorize():
     if request.method == 'GET':
-        with open('../transaction_kind.json', 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        # Only return items where "confirm" is False
-        return jsonify({k: v for k, v in data.items() if not v.get('confirm', False)})
+        return categorize_page()
     elif request.method == 'POST':
-        data = request.get_json()
-        for key, value in data.items():
-            if value['confirm']:
-                data[key]['confidence'] = '100%'
-        with open('../transaction_kind.json', 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2)
+        changes = request.get_json(silent=True)
+        if not isinstance(changes, dict):
+            return jsonify({'error': CHANGES_EXPECTED}), 400
+        # Merged into the store; businesses the client didn't send are left as they are
+        apply_changes(changes)
         return jsonify({'status': 'success'})
 
+def categorize_page():
+    """One page of unconfirmed businesses, filtered and sorted, with a keyset cursor to the next page.
+
+    Query: limit, cursor, category, min_confidence, max_confidence, sort (spend | confidence | name).
+    """
+    transactions.refresh()
+    with store_lock:
+        refresh_categories()
+    etag = hashlib.sha1(f"{STARTED}:{store_version}:{transactions.signature}:{request.query_string!r}"
+                        .encode('utf-8')).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(select_page(request.args))
+    response.set_etag(etag)
+    # Lets the browser revalidate on every poll and reuse its copy on 304
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def select_page(args):
+    limit = min(max(args.get('limit', CATEGORIZE_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    category = args.get('category')
+    min_confidence = args.get('min_confidence', type=float)
+    max_confidence = args.get('max_confidence', type=float)
+    sort = args.get('sort', 'spend')
+    if sort not in SORT_ORDERS:
+        sort = 'spend'
+    spend = transactions.spend()
+
+    items = []
+    with store_lock:
+        for business_name, value in categories.categories.items():
+            # Only return items where "confirm" is False
+            if value.get('confirm', False) or (category and value.get('category') != category):
+                continue
+            confidence = confidence_value(value)
+            if (min_confidence is not None and confidence < min_confidence) or \
+                    (max_confidence is not None and confidence > max_confidence):
+                continue
+            items.append(dict(value, business_name=business_name, spend=round(spend.get(business_name, 0.0), 2)))
+
+    sort_key = {
+        'spend': lambda item: (-item['spend'], item['business_name']),
+        'confidence': lambda item: (-confidence_value(item), item['business_name']),
+        'name': lambda item: (item['business_name'],),
+    }[sort]
+    items.sort(key=sort_key)
+    total = len(items)
+    after = decode_cursor(args.get('cursor'), sort)
+    if after is not None:
+        # Keyset cursor: resume after the last item's sort key, so edits between pages don't shift it
+        items = [item for item in items if list(sort_key(item)) > after]
+    page = items[:limit]
+    return {
+        'items': page,
+        'total': total,
+        'next_cursor': encode_cursor(sort_key(page[-1]), sort) if len(items) > limit else None,
+    }
+
+
+def encode_cursor(key, sort):
+    cursor = json.dumps({'sort': sort, 'after': list(key)}, ensure_ascii=False)
+    return base64.urlsafe_b64encode(cursor.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, sort):
+    """Return the sort key to resume after, or None for a missing, malformed or other-order cursor."""
+    if not cursor:
+        return None
+    try:
+        decoded = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except ValueError:
+        return None
+    if not isinstance(decoded, dict) or decoded.get('sort') != sort:
+        return None
+    after = decoded.get('after')
+    if not isinstance(after, list) or len(after) != len(SORT_ORDERS[sort]):
+        return None
+    for value, kind in zip(after, SORT_ORDERS[sort]):
+        is_number = isinstance(value, (int, float)) and not isinstance(value, bool)
+        if (kind == 'number' and not is_number) or (kind == 'text' and not isinstance(value, str)):
+            return None
+    return after
+
+
+@app.route('/categorize', methods=['PATCH'])
+def update_categories():
+    changes = request.get_json(silent=True)
+    if not isinstance(changes, dict):
+        return jsonify({'error': CHANGES_EXPECTED}), 400
+    updated, errors = apply_changes(changes)
+    return jsonify({'updated': updated, 'errors': errors}), 400 if errors and not updated else 200
+
+@app.route('/categorize/<path:business_name>', methods=['PATCH'])
+def update_category(business_name):
+    updated, errors = apply_changes({business_name: request.get_json(silent=True)})
+    if business_name in updated:
+        return jsonify(updated[business_name])
+    return jsonify({'error': errors[business_name]}), 404 if business_name not in categories else 400
+
 @app.route('/get_details', methods=['POST'])
 def get_details():
     business_name = request.get_json().get('business_name')
-    details = []
-    with open('../cal_cleaned.csv', 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            if row['שם בית עסק'] == business_name:
-                details.append(row)
+    details, _ = transactions.lookup(business_name)
     return jsonify(details)
 
+@app.route('/details', methods=['GET'])
+def details_page():
+    # Paginated variant of get_details for merchants with many transactions
+    business_name = request.args.get('business_name', '')
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', DETAILS_PAGE_SIZE, type=int), 1), 1000)
+    rows, total = transactions.lookup(business_name, offset, limit)
+    return jsonify({
+        'business_name': business_name,
+        'offset': offset,
+        'limit': limit,
+        'total': total,
+        'rows': rows,
+        'next_offset': offset + limit if offset + limit < total else None
+    })
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
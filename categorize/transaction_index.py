@@ -0,0 +1,69 @@
+import csv
+import os
+import threading
+
+BUSINESS_COLUMN = 'שם בית עסק'
+AMOUNT_COLUMN = 'סכום בש"ח'
+
+
+class TransactionIndex:
+    """Rows of a cleaned card statement CSV, indexed by business name.
+
+    The file is read once and kept in memory with a business name -> row positions index, so a
+    lookup costs O(matches), along with each business's total spend. The index is rebuilt when
+    the file's mtime or size changes.
+    """
+
+    def __init__(self, path, key_column=BUSINESS_COLUMN, amount_column=AMOUNT_COLUMN):
+        self.path = path
+        self.key_column = key_column
+        self.amount_column = amount_column
+        self.index = ([], {}, {})
+        self.signature = None
+        self.lock = threading.Lock()
+
+    def lookup(self, business_name, offset=0, limit=None):
+        """Return (rows, total): the business's rows in file order, sliced by offset/limit."""
+        self.refresh()
+        rows, positions, _ = self.index
+        positions = positions.get(business_name, [])
+        end = len(positions) if limit is None else offset + limit
+        return [rows[i] for i in positions[offset:end]], len(positions)
+
+    def spend(self):
+        """Return {business name: total amount} over the whole file."""
+        self.refresh()
+        return self.index[2]
+
+    def refresh(self):
+        try:
+            stat = os.stat(self.path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            signature = None
+        if signature == self.signature:
+            return
+        with self.lock:
+            if signature != self.signature:
+                self._load(signature)
+
+    def _load(self, signature):
+        rows, positions, spend = [], {}, {}
+        if signature is not None:
+            # utf-8-sig: the statement CSVs are written with a BOM, which would otherwise stick to the first header
+            with open(self.path, 'r', encoding='utf-8-sig', newline='') as f:
+                for position, row in enumerate(csv.DictReader(f)):
+                    name = row[self.key_column]
+                    rows.append(row)
+                    positions.setdefault(name, []).append(position)
+                    spend[name] = spend.get(name, 0.0) + parse_amount(row.get(self.amount_column))
+        # Swapped in as one tuple, so a concurrent lookup sees either the old or the new index
+        self.index = (rows, positions, spend)
+        self.signature = signature
+
+
+def parse_amount(text):
+    try:
+        return float(str(text).replace(',', ''))
+    except ValueError:
+        return 0.0
@@ -0,0 +1,184 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows, where the lock file is locked with msvcrt instead
+    fcntl = None
+    import msvcrt
+
+LOG_SUFFIX = '.log'
+LOCK_SUFFIX = '.lock'
+COMPACT_AFTER = 1000
+LOCK_RETRY_DELAY = 0.05  # seconds between attempts to take a Windows lock
+
+
+class CategoryStore:
+    """Business name -> categorization cache backed by a JSON snapshot and an append-only log.
+
+    The snapshot (e.g. transaction_kind.json) keeps its usual format. Updates are appended to
+    `<snapshot>.log` as one JSON line per business and fsynced, so a write costs O(batch) and a crash
+    can at worst lose the line being written. compact() folds the log into a new snapshot written to a
+    temporary file and atomically renamed over the old one.
+
+    Several processes can share the files (the categorization scripts and the categorize app):
+    appends and compaction hold an exclusive lock on `<snapshot>.lock` (flock, or msvcrt.locking on
+    Windows, where readers take the exclusive lock too), and both first reload the files if another
+    process changed them, so compact() never drops an entry it didn't load. refresh() picks up other
+    processes' writes for long-running readers.
+    """
+
+    def __init__(self, path, compact_after=COMPACT_AFTER):
+        self.path = path
+        self.log_path = path + LOG_SUFFIX
+        self.lock_path = path + LOCK_SUFFIX
+        self.compact_after = compact_after
+        with self._locked(exclusive=False):
+            self._load()
+
+    def __contains__(self, name):
+        return name in self.categories
+
+    def __getitem__(self, name):
+        return self.categories[name]
+
+    def get(self, name, default=None):
+        return self.categories.get(name, default)
+
+    def refresh(self):
+        """Reload the snapshot and log if another process changed them. Returns whether it reloaded."""
+        with self._locked(exclusive=False):
+            return self._reload_if_changed()
+
+    def update(self, entries):
+        if not entries:
+            return
+        with self._locked(exclusive=True):
+            self._append(entries)
+        if self.log_entries >= self.compact_after:
+            self.compact()
+
+    def _append(self, entries):
+        self._reload_if_changed()
+        with open(self.log_path, 'a+b') as f:
+            # A line torn by a crash mid-append is left for replay to skip; start on a fresh line after it
+            if f.seek(0, os.SEEK_END) and not self._ends_with_newline(f):
+                f.write(b'\n')
+            for name, value in entries.items():
+                f.write((json.dumps({'name': name, 'value': value}, ensure_ascii=False) + '\n').encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+        self.categories.update(entries)
+        self.log_entries += len(entries)
+        self.signature = self._disk_signature()
+
+    def compact(self):
+        with self._locked(exclusive=True):
+            self._compact()
+
+    def _compact(self):
+        self._reload_if_changed()
+        if not self.log_entries and os.path.exists(self.path):
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.categories, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        # A crash before the log is cleared only means replaying entries the snapshot already has
+        open(self.log_path, 'w').close()
+        self.log_entries = 0
+        self.signature = self._disk_signature()
+
+    def _load(self):
+        self.categories = self._read_snapshot()
+        self.log_entries = self._replay_log()
+        self.signature = self._disk_signature()
+
+    def _reload_if_changed(self):
+        if self._disk_signature() == self.signature:
+            return False
+        self._load()
+        return True
+
+    def _disk_signature(self):
+        # Modification time and size of the snapshot and the log; None for a missing file
+        signature = []
+        for path in (self.path, self.log_path):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    @contextmanager
+    def _locked(self, exclusive):
+        # Readers skip the lock until a writer has created its file, so loading never writes anything
+        if not exclusive and not os.path.exists(self.lock_path):
+            yield
+            return
+        with open(self.lock_path, 'a+b') as lock:
+            _lock_file(lock, exclusive)
+            try:
+                yield
+            finally:
+                _unlock_file(lock)
+
+    def _read_snapshot(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _replay_log(self):
+        """Apply the log's entries over the snapshot. Read-only: bad lines are skipped, not removed."""
+        entries = 0
+        try:
+            with open(self.log_path, 'rb') as f:
+                for number, line in enumerate(f, 1):
+                    if not line.endswith(b'\n'):
+                        # The last append was torn by a crash; update() starts a new line after it
+                        print(f"Ignoring the incomplete last line of {self.log_path}")
+                        break
+                    try:
+                        entry = json.loads(line)
+                        self.categories[entry['name']] = entry['value']
+                    except (json.JSONDecodeError, UnicodeDecodeError, TypeError, KeyError):
+                        print(f"Skipping corrupt line {number} of {self.log_path}")
+                        continue
+                    entries += 1
+        except FileNotFoundError:
+            return 0
+        return entries
+
+    @staticmethod
+    def _ends_with_newline(f):
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
+
+
+def _lock_file(lock, exclusive):
+    if fcntl is not None:
+        fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        return
+    # msvcrt locks a byte range and has no shared mode; LK_LOCK gives up after ten tries, so retry here
+    lock.seek(0)
+    while True:
+        try:
+            msvcrt.locking(lock.fileno(), msvcrt.LK_NBLCK, 1)
+            return
+        except OSError:
+            time.sleep(LOCK_RETRY_DELAY)
+
+
+def _unlock_file(lock):
+    if fcntl is not None:
+        fcntl.flock(lock, fcntl.LOCK_UN)
+        return
+    lock.seek(0)
+    msvcrt.locking(lock.fileno(), msvcrt.LK_UNLCK, 1)
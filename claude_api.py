@@ -3,67 +3,169 @@
 import requests
 import json
 import configparser
+import random
+import threading
+import time
+from requests.adapters import HTTPAdapter
+# categorize_expenses is re-exported for callers that import it from here, as before the providers
+from categorization import EXPENSE_CATEGORIES, Provider, categorize_expenses
+
+try:
+    from instrumentation import record_api_call
+except ImportError:  # run from this folder, where new_v is a package
+    from new_v.instrumentation import record_api_call
 
 # Read configuration from INI file
 config = configparser.ConfigParser()
 config.read('config_claude.ini')
 
-API_URL = "https://api.anthropic.com/v1/messages"
-API_KEY = config['DEFAULT']['ApiKey']
-
-EXPENSE_CATEGORIES = [
-    "Shopping", "Groceries", "Utilities", "Transportation", "Travel",
-    "Dining Out", "Online Services", "Healthcare", "Education", "Entertainment",
-    "Home Maintenance", "Personal Care", "Gifts & Donations", "Insurance",
-    "Taxes", "Debt Payments", "Savings & Investments", "Business Expenses",
-    "Pet Care", "Other"
-]
-
-TRANSACTION_KIND_FILE = 'transaction_kind.json'
-
-
-def load_known_transactions():
-    try:
-        with open(TRANSACTION_KIND_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
-
+API_URL = config['DEFAULT'].get('ApiUrl', "https://api.anthropic.com/v1/messages")
+API_KEY = config['DEFAULT'].get('ApiKey')
+
+# Client tuning, overridable from config_claude.ini
+MAX_CONCURRENCY = config['DEFAULT'].getint('MaxConcurrency', 4)
+REQUESTS_PER_MINUTE = config['DEFAULT'].getfloat('RequestsPerMinute', 50)
+MAX_RETRIES = config['DEFAULT'].getint('MaxRetries', 5)
+REQUEST_TIMEOUT = config['DEFAULT'].getfloat('RequestTimeout', 300)
+STRUCTURED_OUTPUT = config['DEFAULT'].getboolean('StructuredOutput', True)
+MAX_RESPONSE_TOKENS = config['DEFAULT'].getint('MaxTokens', 4096)
+MAX_BATCH_SIZE = config['DEFAULT'].getint('MaxBatchSize', 60)
+# Per-run limits on the tokens and dollars spent on categorization; 0 means no limit
+TOKEN_BUDGET = config['DEFAULT'].getint('TokenBudget', 0)
+COST_BUDGET = config['DEFAULT'].getfloat('CostBudget', 0)
+INPUT_COST_PER_MTOK = config['DEFAULT'].getfloat('InputCostPerMTok', 3.0)
+OUTPUT_COST_PER_MTOK = config['DEFAULT'].getfloat('OutputCostPerMTok', 15.0)
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504, 529}
+
+# Forcing this tool makes the API return the categorizations as JSON matching the schema
+CATEGORIZATION_TOOL = {
+    "name": "record_categorizations",
+    "description": "Record the expense category of each business.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "categorizations": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "business": {"type": "string", "description": "The business name exactly as given"},
+                        "category": {"type": "string", "enum": EXPENSE_CATEGORIES},
+                        "confidence": {"type": "integer", "minimum": 0, "maximum": 100},
+                        "explanation": {"type": "string"}
+                    },
+                    "required": ["business", "category", "confidence", "explanation"]
+                }
+            }
+        },
+        "required": ["categorizations"]
+    }
+}
+
+class TokenBucket:
+    """Thread-safe token bucket: allows bursts of `capacity` requests and refills at `rate` per second."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def create_session(pool_size=MAX_CONCURRENCY):
+    # One pooled session shared by all worker threads, so connections are reused between batches
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class ClaudeProvider(Provider):
+    """Categorizes through the Messages API, over one pooled session and under a shared request rate limit."""
+
+    name = 'claude'
+    max_response_tokens = MAX_RESPONSE_TOKENS
+    max_batch_size = MAX_BATCH_SIZE
+    input_cost_per_mtok = INPUT_COST_PER_MTOK
+    output_cost_per_mtok = OUTPUT_COST_PER_MTOK
+    token_budget = TOKEN_BUDGET
+    cost_budget = COST_BUDGET
+
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, requests_per_minute=REQUESTS_PER_MINUTE,
+                 structured=STRUCTURED_OUTPUT):
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = TokenBucket(requests_per_minute / 60, max_concurrency)
+        self.structured = structured
+        self.session = None
+
+    def request(self, businesses, max_tokens, usage):
+        request = request_structured_categories if self.structured else request_text_categories
+        return request(businesses, self.session or requests, self.rate_limiter, max_tokens, usage)
+
+    def __enter__(self):
+        self.session = create_session(self.max_concurrency)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.session.close()
+        self.session = None
+
+
+def api_headers():
+    return {
+        "Content-Type": "application/json",
+        "x-api-key": API_KEY,
+        "anthropic-version": "2023-06-01"
+    }
 
-def save_known_transactions(known_transactions):
-    with open(TRANSACTION_KIND_FILE, 'w', encoding='utf-8') as f:
-        json.dump(known_transactions, f, ensure_ascii=False, indent=2)
 
+def request_structured_categories(businesses, session, rate_limiter=None, max_tokens=MAX_RESPONSE_TOKENS, usage=None):
+    prompt = f"""
+    Categorize each of these businesses into one of these categories: {', '.join(EXPENSE_CATEGORIES)}
 
-def categorize_expenses(businesses_names):
-    known_transactions = load_known_transactions()
-    new_categorizations = {}
-    batch_size = 20
+    Businesses (JSON list): {json.dumps(businesses, ensure_ascii=False)}
 
-    for i in range(0, len(businesses_names), batch_size):
-        print("start new loop")
-        batch = businesses_names[i:i + batch_size]
-        uncategorized = [b for b in batch if b not in known_transactions]
+    Give a confidence level (0-100) and a brief explanation for each one.
+    If a business type is unclear, indicate a lower confidence and explain why.
+    Record every business with the {CATEGORIZATION_TOOL['name']} tool, using its name exactly as given.
+    """
 
-        if uncategorized:
-            batch_results = get_category_from_ai(uncategorized)
-            new_categorizations.update(batch_results)
-            known_transactions.update(batch_results)
-            save_known_transactions(known_transactions)
+    data = {
+        "model": "claude-3-5-sonnet-20240620",
+        "system": "You are an experienced accountant.",
+        "messages": [{"role": "user", "content": prompt}],
+        "tools": [CATEGORIZATION_TOOL],
+        "tool_choice": {"type": "tool", "name": CATEGORIZATION_TOOL['name']},
+        "max_tokens": max_tokens
+    }
 
-        # Add known transactions for this batch
-        new_categorizations.update({b: known_transactions[b] for b in batch if b in known_transactions})
+    response = post_with_retry(session, api_headers(), data, rate_limiter)
 
-    return new_categorizations
+    if response is not None and response.status_code == 200:
+        body = response.json()
+        record_usage(body, usage)
+        return parse_structured_response(body['content'], businesses)
+    if response is not None:
+        print(f"Error: {response.status_code}")
+        print(response.text)
+    return None
 
 
-def get_category_from_ai(businesses):
-    headers = {
-        "Content-Type": "application/json",
-        "x-api-key": API_KEY,
-        "anthropic-version": "2023-06-01"
-    }
-
+def request_text_categories(businesses, session, rate_limiter=None, max_tokens=MAX_RESPONSE_TOKENS, usage=None):
     prompt = f"""
     Categorize the following businesses into these categories: {', '.join(EXPENSE_CATEGORIES)}
 
@@ -89,18 +191,56 @@ def get_category_from_ai(businesses):
         "model": "claude-3-5-sonnet-20240620",
         "system": "You are an experienced accountant.",
         "messages": [{"role": "user", "content": prompt}],
-        "max_tokens": 2000
+        "max_tokens": max_tokens
     }
 
-    response = requests.post(API_URL, headers=headers, json=data, timeout=10000)
+    response = post_with_retry(session, api_headers(), data, rate_limiter)
 
-    if response.status_code == 200:
-        ai_response = response.json()['content'][0]['text']
+    if response is not None and response.status_code == 200:
+        body = response.json()
+        record_usage(body, usage)
+        ai_response = body['content'][0]['text']
         return parse_ai_response(ai_response, businesses)
-    else:
+    if response is not None:
         print(f"Error: {response.status_code}")
         print(response.text)
-        return {}
+    return None
+
+
+def record_usage(body, usage):
+    # The token counts and stop reason of a response, for the caller's TokenBudget
+    if usage is not None:
+        usage.update(body.get('usage') or {}, stop_reason=body.get('stop_reason'))
+
+
+def post_with_retry(session, headers, data, rate_limiter=None):
+    """POST to the API, retrying rate limits, server errors and dropped connections with exponential backoff."""
+    response = None
+    for attempt in range(MAX_RETRIES + 1):
+        if rate_limiter:
+            rate_limiter.acquire()
+        start = time.perf_counter()
+        try:
+            response = session.post(API_URL, headers=headers, json=data, timeout=REQUEST_TIMEOUT)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            print(f"Request failed: {e}")
+            response = None
+            record_api_call('claude', time.perf_counter() - start, error=type(e).__name__)
+        else:
+            record_api_call('claude', time.perf_counter() - start, response.status_code)
+        if response is not None and response.status_code not in RETRY_STATUS_CODES:
+            return response
+        if attempt < MAX_RETRIES:
+            time.sleep(retry_delay(response, attempt))
+    return response
+
+
+def retry_delay(response, attempt):
+    retry_after = response.headers.get('retry-after') if response is not None else None
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return min(60, 2 ** attempt) * random.uniform(0.5, 1.5)
 
 
 def parse_ai_response(ai_response, businesses):
@@ -128,6 +268,67 @@ def parse_ai_response(ai_response, businesses):
     return results
 
 
+def parse_structured_response(content, businesses):
+    """Validate the categorizations in a response's content blocks; invalid or unrequested entries are dropped.
+
+    Accepts the forced tool call, or JSON in a text block (possibly fenced) if the model answered in text.
+    """
+    payload = None
+    for block in content:
+        if block.get('type') == 'tool_use':
+            payload = block.get('input')
+            break
+        if block.get('type') == 'text':
+            payload = extract_json(block.get('text', ''))
+            if payload is not None:
+                break
+    if isinstance(payload, dict):
+        payload = payload.get('categorizations')
+    if not isinstance(payload, list):
+        return {}
+
+    requested = {normalize_name(b): b for b in businesses}
+    categories = {c.lower(): c for c in EXPENSE_CATEGORIES}
+    results = {}
+    for item in payload:
+        if not isinstance(item, dict):
+            continue
+        business = requested.get(normalize_name(item.get('business', '')))
+        category = categories.get(str(item.get('category', '')).strip().lower())
+        confidence = parse_confidence(item.get('confidence'))
+        if business is None or category is None or confidence is None:
+            continue
+        results[business] = {
+            'category': category,
+            'confidence': f'{confidence}%',
+            'explanation': str(item.get('explanation', '')).strip(),
+        }
+    return results
+
+
+def extract_json(text):
+    start = min((i for i in (text.find('{'), text.find('[')) if i != -1), default=-1)
+    end = max(text.rfind('}'), text.rfind(']'))
+    if start == -1 or end < start:
+        return None
+    try:
+        return json.loads(text[start:end + 1])
+    except json.JSONDecodeError:
+        return None
+
+
+def normalize_name(name):
+    return ' '.join(str(name).split()).casefold()
+
+
+def parse_confidence(value):
+    try:
+        confidence = round(float(str(value).strip().rstrip('%')))
+    except (ValueError, OverflowError):
+        return None
+    return confidence if 0 <= confidence <= 100 else None
+
+
 # Example usage (can be commented out when using as a module)
 if __name__ == "__main__":
     all_businesses = [
@@ -138,7 +339,7 @@ if __name__ == "__main__":
         "LOCAL RESTAURANT"
     ]
 
-    categorizations = categorize_expenses(all_businesses)
+    categorizations = categorize_expenses(all_businesses, ClaudeProvider())
     for business, details in categorizations.items():
         print(f"\n{business}:")
         print(f"Category: {details['category']}")
@@ -1,6 +1,7 @@
 import requests
 import json
 import configparser
+from categorization import EXPENSE_CATEGORIES, Provider
 
 # Read configuration from INI file
 config = configparser.ConfigParser()
@@ -10,50 +11,15 @@ PROJECT_ID = config['DEFAULT']['ProjectId']  # Your GCP Project ID
 REGION = config['DEFAULT']['Region']  # Region where your Vertex AI endpoint is deployed
 ENDPOINT_NAME = config['DEFAULT']['EndpointName']  # Name of your deployed Vertex AI Endpoint
 
-EXPENSE_CATEGORIES = [
-    "Shopping", "Groceries", "Utilities", "Transportation", "Travel",
-    "Dining Out", "Online Services", "Healthcare", "Education", "Entertainment",
-    "Home Maintenance", "Personal Care", "Gifts & Donations", "Insurance",
-    "Taxes", "Debt Payments", "Savings & Investments", "Business Expenses",
-    "Pet Care", "Other"
-]
+class GeminiProvider(Provider):
+    """Categorizes through the deployed Vertex AI endpoint, which doesn't report token usage."""
 
-TRANSACTION_KIND_FILE = 'transaction_kind_g.json'
+    name = 'gemini'
+    max_batch_size = 20
 
-
-def load_known_transactions():
-    try:
-        with open(TRANSACTION_KIND_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
-
-
-def save_known_transactions(known_transactions):
-    with open(TRANSACTION_KIND_FILE, 'w', encoding='utf-8') as f:
-        json.dump(known_transactions, f, ensure_ascii=False, indent=2)
-
-
-def categorize_expenses(businesses_names):
-    known_transactions = load_known_transactions()
-    new_categorizations = {}
-    batch_size = 20
-
-    for i in range(0, len(businesses_names), batch_size):
-        print("start new loop")
-        batch = businesses_names[i:i + batch_size]
-        uncategorized = [b for b in batch if b not in known_transactions]
-
-        if uncategorized:
-            batch_results = get_category_from_ai(uncategorized)
-            new_categorizations.update(batch_results)
-            known_transactions.update(batch_results)
-            save_known_transactions(known_transactions)
-
-        # Add known transactions for this batch
-        new_categorizations.update({b: known_transactions[b] for b in batch if b in known_transactions})
-
-    return new_categorizations
+    def request(self, businesses, max_tokens, usage):
+        # An empty answer is how get_category_from_ai reports a failed request
+        return get_category_from_ai(businesses) or None
 
 
 def get_category_from_ai(businesses):
@@ -112,6 +78,7 @@ def get_access_token():
 
 # Example usage (can be commented out when using as a module)
 if __name__ == "__main__":
+    from categorization import categorize_expenses
     all_businesses = [
         "SUPER-PHARM",
         "GETT",
@@ -120,7 +87,7 @@ if __name__ == "__main__":
         "LOCAL RESTAURANT"
     ]
 
-    categorizations = categorize_expenses(all_businesses)
+    categorizations = categorize_expenses(all_businesses, GeminiProvider())
     for business, details in categorizations.items():
         print(f"\n{business}:")
         print(f"Category: {details['category']}")
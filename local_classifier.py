@@ -0,0 +1,122 @@
+import numpy as np
+from merchant_index import canonicalize, confidence_value
+
+NGRAM_RANGE = (2, 4)
+MIN_DOCUMENT_FREQUENCY = 2
+MIN_PROBABILITY = 0.8
+PREDICTED_BY = 'local_classifier'
+CONFIRMED_WEIGHT = 3.0
+EPOCHS = 100
+LEARNING_RATE = 20.0
+L2 = 1e-4
+
+
+def char_ngrams(name):
+    text = f' {canonicalize(name)} '
+    return [text[i:i + n] for n in range(NGRAM_RANGE[0], NGRAM_RANGE[1] + 1) for i in range(len(text) - n + 1)]
+
+
+class LocalClassifier:
+    """Multinomial logistic regression over TF-IDF character n-grams of merchant names, in plain NumPy.
+
+    Trained from the categorization cache at startup. Features are kept sparse as (row, column, value)
+    arrays and every matrix product is a bincount per category, so the cost grows with the n-grams
+    present rather than names x vocabulary.
+    """
+
+    def __init__(self, vocabulary, idf, classes, weights, bias):
+        self.vocabulary = vocabulary
+        self.idf = idf
+        self.classes = classes
+        self.weights = weights
+        self.bias = bias
+
+    @classmethod
+    def train(cls, categories, epochs=EPOCHS, learning_rate=LEARNING_RATE, l2=L2,
+              min_document_frequency=MIN_DOCUMENT_FREQUENCY):
+        """Fit on {name: {'category', 'confidence', 'confirm', ...}}; confirmed entries weigh the most."""
+        names, labels, sample_weights = [], [], []
+        for name, value in categories.items():
+            # Unconfirmed predictions of this model would only reinforce themselves
+            if not value.get('category') or (value.get('predicted_by') == PREDICTED_BY and not value.get('confirm')):
+                continue
+            names.append(name)
+            labels.append(value['category'])
+            sample_weights.append(CONFIRMED_WEIGHT if value.get('confirm') else max(confidence_value(value), 50) / 100)
+        classes = sorted(set(labels))
+
+        # n-grams seen in a single name only memorize that name, so they are left out of the vocabulary
+        document_frequency = {}
+        for name in names:
+            for gram in set(char_ngrams(name)):
+                document_frequency[gram] = document_frequency.get(gram, 0) + 1
+        kept = [gram for gram, count in document_frequency.items() if count >= min_document_frequency]
+        vocabulary = {gram: column for column, gram in enumerate(kept)}
+        idf = np.log((1 + len(names)) / (1 + np.array([document_frequency[g] for g in kept], dtype=float))) + 1
+
+        model = cls(vocabulary, idf, classes, np.zeros((len(vocabulary), len(classes))), np.zeros(len(classes)))
+        if not names:
+            return model
+        rows, columns, values = model._features(names)
+        targets = np.zeros((len(names), len(classes)))
+        targets[np.arange(len(names)), [classes.index(label) for label in labels]] = 1
+        sample_weights = np.asarray(sample_weights)[:, None] / np.sum(sample_weights)
+
+        for _ in range(epochs):
+            error = (model._probabilities(rows, columns, values, len(names)) - targets) * sample_weights
+            gradient = np.column_stack([
+                np.bincount(columns, weights=values * error[rows, c], minlength=len(vocabulary))
+                for c in range(len(classes))
+            ])
+            model.weights -= learning_rate * (gradient + l2 * model.weights)
+            model.bias -= learning_rate * error.sum(axis=0)
+        return model
+
+    def predict(self, names):
+        """Return (category, probability) for each name."""
+        if not self.classes:
+            return [(None, 0.0) for _ in names]
+        probabilities = self._probabilities(*self._features(names), len(names))
+        best = probabilities.argmax(axis=1)
+        return [(self.classes[b], float(probabilities[i, b])) for i, b in enumerate(best)]
+
+    def categorize(self, names, min_probability=MIN_PROBABILITY):
+        """Return cache entries for the names predicted with at least min_probability; the rest are left out."""
+        return {
+            name: {
+                'category': category,
+                'confidence': f'{probability:.0%}',
+                'explanation': 'Predicted offline from the names of already categorized businesses',
+                'confirm': False,
+                'predicted_by': PREDICTED_BY,
+            }
+            for name, (category, probability) in zip(names, self.predict(names))
+            if probability >= min_probability
+        }
+
+    def _features(self, names):
+        """L2-normalized TF-IDF vectors of the names as (row, column, value) arrays."""
+        rows, columns, counts = [], [], []
+        for row, name in enumerate(names):
+            grams = {}
+            for gram in char_ngrams(name):
+                column = self.vocabulary.get(gram)
+                if column is not None:
+                    grams[column] = grams.get(column, 0) + 1
+            rows.extend([row] * len(grams))
+            columns.extend(grams)
+            counts.extend(grams.values())
+        rows = np.asarray(rows, dtype=np.int64)
+        columns = np.asarray(columns, dtype=np.int64)
+        values = np.asarray(counts, dtype=float) * self.idf[columns]
+        norms = np.sqrt(np.bincount(rows, weights=values ** 2, minlength=len(names)))
+        return rows, columns, values / norms[rows]
+
+    def _probabilities(self, rows, columns, values, n_names):
+        scores = self.bias + np.column_stack([
+            np.bincount(rows, weights=values * self.weights[columns, c], minlength=n_names)
+            for c in range(len(self.classes))
+        ])
+        scores -= scores.max(axis=1, keepdims=True)
+        exp_scores = np.exp(scores)
+        return exp_scores / exp_scores.sum(axis=1, keepdims=True)
@@ -0,0 +1,129 @@
+import re
+from collections import Counter, defaultdict
+
+MIN_SIMILARITY = 0.75
+MIN_CONFIDENCE = 90
+MIN_BRAND_LENGTH = 4
+
+# Legal-entity suffixes that say nothing about what a business sells
+LEGAL_SUFFIXES = {'LTD', 'LLC', 'INC', 'SA', 'AE', 'IKE', 'EPE', 'OE', 'GMBH', 'SL', 'BV', 'SRL'}
+# Payment processors that prefix the real merchant's name ('PAYPAL *NETFLIX'); they aren't brands
+PAYMENT_AGGREGATORS = ['PAYPAL', 'PP', 'SQ', 'SUMUP', 'ZETTLE', 'IZ', 'GOOGLE', 'CARDLINK ONE']
+AGGREGATOR_PREFIX = re.compile(r'^\s*(?:' + '|'.join(map(re.escape, PAYMENT_AGGREGATORS)) + r')\s*\*\s*')
+
+
+def canonicalize(name):
+    """Normalize a card-statement merchant name so that variants of one merchant compare equal.
+
+    Upper-cases, strips payment-aggregator prefixes ('PAYPAL *'), turns punctuation into spaces, and drops
+    terminal/order IDs (tokens mixing letters and digits, e.g. 'AI0000000PBNVEJ'), pure numbers (branch
+    and terminal numbers) and legal suffixes.
+    """
+    upper = str(name).upper()
+    upper = AGGREGATOR_PREFIX.sub('', upper) or upper
+    tokens = re.sub(r'[^\w]+', ' ', upper).replace('_', ' ').split()
+    kept = [t for t in tokens
+            if not t.isdigit()
+            and not (re.search(r'\d', t) and re.search(r'[^\W\d]', t) and len(t) >= 5)
+            and t not in LEGAL_SUFFIXES]
+    return ' '.join(kept or tokens)
+
+
+def trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def confidence_value(value):
+    try:
+        return float(str(value.get('confidence', 0)).strip().rstrip('%'))
+    except ValueError:
+        return 0.0
+
+
+class MerchantIndex:
+    """Finds an already categorized merchant for a new name, so it can reuse that category offline.
+
+    Only trusted entries are used as sources: confirmed in the review app, or categorized with at least
+    min_confidence. A lookup tries, in order: the canonical name, trigram (Jaccard) similarity of
+    canonical names, and a shared leading brand token whose confirmed entries all agree on one
+    category (a single model guess is too weak to vouch for every name starting with that word).
+    """
+
+    def __init__(self, categories, min_similarity=MIN_SIMILARITY, min_confidence=MIN_CONFIDENCE):
+        self.min_similarity = min_similarity
+        self.min_confidence = min_confidence
+        self.names = []
+        self.values = []
+        self.by_canonical = {}
+        self.postings = defaultdict(list)
+        self.gram_counts = []
+        self.brands = defaultdict(set)
+        self.lookups = 0
+        self.hits = Counter()
+        for name, value in categories.items():
+            self.add(name, value)
+
+    def add(self, name, value):
+        if not (value.get('confirm') or (confidence_value(value) >= self.min_confidence
+                                         and not value.get('predicted_by'))):
+            return
+        canonical = canonicalize(name)
+        if canonical in self.by_canonical:
+            return
+        entry_id = len(self.names)
+        self.names.append(name)
+        self.values.append(value)
+        self.by_canonical[canonical] = entry_id
+        grams = trigrams(canonical)
+        self.gram_counts.append(len(grams))
+        for gram in grams:
+            self.postings[gram].append(entry_id)
+        brand = canonical.split()[0] if canonical else ''
+        if len(brand) >= MIN_BRAND_LENGTH and value.get('confirm'):
+            self.brands[brand].add(entry_id)
+
+    def lookup(self, name):
+        """Return a categorization inherited from a similar known merchant, or None."""
+        self.lookups += 1
+        canonical = canonicalize(name)
+        match = self._match(canonical)
+        if match is None:
+            return None
+        kind, entry_id = match
+        self.hits[kind] += 1
+        inherited = dict(self.values[entry_id])
+        inherited.update({
+            'confirm': False,
+            'matched_from': self.names[entry_id],
+            'match': kind,
+        })
+        return inherited
+
+    def _match(self, canonical):
+        if canonical in self.by_canonical:
+            return 'canonical', self.by_canonical[canonical]
+
+        grams = trigrams(canonical)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+        if shared:
+            similarity, entry_id = max((common / (len(grams) + self.gram_counts[i] - common), -i)
+                                       for i, common in shared.items())
+            if similarity >= self.min_similarity:
+                return 'similar', -entry_id
+
+        entries = self.brands.get(canonical.split()[0] if canonical else '', ())
+        if entries and len({self.values[i].get('category') for i in entries}) == 1:
+            return 'brand', min(entries)
+        return None
+
+    def stats(self):
+        hits = sum(self.hits.values())
+        return {
+            'lookups': self.lookups,
+            'hits': hits,
+            'hit_rate': hits / self.lookups if self.lookups else 0.0,
+            'by_match': dict(self.hits),
+        }
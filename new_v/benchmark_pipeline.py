@@ -0,0 +1,289 @@
+# benchmark_pipeline.py
+#
+# Times each stage of the pipeline on deterministic synthetic bank and CAL ledgers and writes the
+# results as JSON, so runs can be compared. Run from the new_v folder:
+#   python benchmark_pipeline.py [--sizes 10k 1m 10m] [--output results.json] [--compare previous.json]
+# 10m needs several GB of memory for the raw (all-object) statement frames.
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from calculations import earning_expenses, earning_expenses_by_period, group_by_business, period_partials
+from data_processing import parse_cal_statement, process_data
+from report_generation import write_partials
+
+# The categorization cache and merchant index live with the categorization scripts in the parent folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from categorization import MockProvider, categorize_expenses
+from category_store import LOG_SUFFIX, CategoryStore
+from merchant_index import MerchantIndex
+
+SIZES = {'10k': 10_000, '1m': 1_000_000, '10m': 10_000_000}
+DEFAULT_SIZES = ['10k', '1m']
+SEED = 0
+# A stage this much slower than in the compared run is reported as a regression
+REGRESSION_RATIO = 1.2
+# Share of the distinct merchants already in the categorization cache
+CACHED_SHARE = 0.6
+
+BANK_COLUMNS = ['תאריך', 'הפעולה', 'פרטים', 'אסמכתא', 'חובה', 'זכות', "יתרה בש''ח", 'תאריך ערך', 'לטובת', 'עבור']
+CAL_COLUMNS = ['תאריך\nעסקה', 'שם בית עסק', 'סכום\nבש"ח', 'מועד\nחיוב', 'סוג עסקה', 'מזהה כרטיס\nבארנק דיגילטי',
+               'הנחה', 'הערות']
+# (operation, weight, share of the rows that are earnings)
+BANK_OPERATIONS = [
+    ('כאל', 30, 0.0), ('bit העברת כסף', 18, 0.4), ("העב' לאחר-נייד", 12, 0.0), ('הוראת-קבע', 10, 0.0),
+    ('העברה/הפקדה', 8, 1.0), ('משיכה מבנקט', 6, 0.0), ('ע.מפעולות-ישיר', 5, 0.0), ('מטח-קניה', 3, 0.0),
+    ('ביטוח לאומי', 3, 0.0), ('מס הכנסה עצמאי', 2, 0.0), ('זיכוי מלאומי', 2, 1.0), ('מופ"ת חובה', 1, 1.0),
+]
+# Operations whose rows carry 'לטובת: ... עבור: ...' details; the rest have none
+TRANSFER_OPERATIONS = {'bit העברת כסף', "העב' לאחר-נייד", 'הוראת-קבע', 'העברה/הפקדה', 'מופ"ת חובה'}
+MERCHANTS = [
+    'שופרסל דיל', 'רמי לוי שיווק השקמה', 'מחסני השוק- יד בינימין', 'WOLT', 'PAYPAL *ALIEXPRESS', 'פז חברת נפט',
+    'סופר-פארם', 'ארומה', 'YANGO', 'GOOGLE *YouTube', 'NETFLIX.COM', 'חברת החשמל לישראל', 'הוט מובייל', 'פלאפון',
+    'כללית', 'רב-קו', 'מ. התחבורה - פנגו מוביט', 'דרך החומוס', 'APEXTRADERFUNDING', 'Google Storage', 'BIT',
+    'BKG*HOTEL AT BOOKING.C', 'יענקל\'ס', 'קפה גרג', 'איקאה', 'ACE', 'KSP', 'מקדונלדס', 'דומינו\'ס פיצה',
+    'AMAZON MKTPLACE PMTS', 'SPOTIFY', 'APPLE.COM/BILL', 'RAILWAY', 'CloudwaysLTD', 'PAYPAL *PATREON',
+    'אלון רבוע כחול', 'ויקטורי', 'יוחננוף', 'מגה בעיר', 'פוקס', 'קסטרו', 'H&M', 'ZARA', 'גולף', 'שילב',
+    'בית מרקחת', 'מכבי שירותי בריאות', 'אגד', 'דן', 'חניון אחוזת החוף', 'סונול', 'דלק', 'TEN', 'UBER *TRIP',
+]
+CARD_TRANSACTION_TYPES = [('רגילה', 0.93), ('הוראת קבע', 0.03), ('תשלומים', 0.015), ('דמי חבר', 0.015),
+                          ('זיכוי', 0.01)]
+CATEGORIES = ['Groceries', 'Dining', 'Transport', 'Shopping', 'Utilities', 'Health', 'Subscriptions', 'Travel']
+
+
+def make_merchant_names(rows: int, rng: np.random.Generator) -> np.ndarray:
+    """Zipf-distributed merchants: a few take most of the charges, with a long tail of branches and terminals."""
+    ranks = np.arange(1, len(MERCHANTS) + 1)
+    weights = 1 / ranks ** 1.1
+    bases = rng.choice(len(MERCHANTS), rows, p=weights / weights.sum())
+    # Most charges come from a merchant's main name; the rest from numbered branches, as on real statements
+    branches = np.where(rng.random(rows) < 0.7, 0, rng.geometric(0.02, rows))
+    keys = bases * 1_000_000 + branches
+    unique_keys, codes = np.unique(keys, return_inverse=True)
+    names = np.array([MERCHANTS[key // 1_000_000] + (f' {key % 1_000_000}' if key % 1_000_000 else '')
+                      for key in unique_keys], dtype=object)
+    return names[codes]
+
+
+def make_dates(rows: int, rng: np.random.Generator, days: int) -> pd.DatetimeIndex:
+    # Newest first, like the exported statements
+    offsets = np.sort(rng.integers(0, days, rows))[::-1]
+    return pd.Timestamp('2015-01-01') + pd.to_timedelta(offsets, unit='D')
+
+
+def make_bank_statement(rows: int, seed: int = SEED) -> pd.DataFrame:
+    """Raw bank statement as read_excel(header=None) returns it: preamble rows, the header row, then object cells."""
+    rng = np.random.default_rng(seed)
+    names, weights, earning_shares = zip(*BANK_OPERATIONS)
+    weights = np.array(weights, dtype=float)
+    picked = rng.choice(len(names), rows, p=weights / weights.sum())
+    operations = np.array(names, dtype=object)[picked]
+    is_earning = rng.random(rows) < np.array(earning_shares)[picked]
+    amounts = np.round(rng.gamma(1.5, 400.0, rows), 2)
+    # Whole amounts are ints in the cells, as read_excel returns them
+    amount_cells = np.where(amounts == np.round(amounts), amounts.astype(np.int64), amounts).astype(object)
+    dates = make_dates(rows, rng, days=3650)
+
+    people = np.array([f'מוטב {i}' for i in range(max(rows // 50, 10))], dtype=object)
+    beneficiaries = people[rng.integers(0, len(people), rows)]
+    purposes = np.array(['שכר דירה', 'החזר', 'משכורת', 'ארנונה', 'ועד בית', 'מתנה'], dtype=object)[
+        rng.integers(0, 6, rows)]
+    is_transfer = np.isin(operations, list(TRANSFER_OPERATIONS))
+    details = np.where(is_transfer, 'לטובת:  ' + beneficiaries + '   עבור: ' + purposes + ' ,', None)
+
+    data = pd.DataFrame({
+        0: list(dates.to_pydatetime()),
+        1: operations,
+        2: details,
+        3: rng.integers(10_000, 9_999_999, rows).astype(object),
+        4: np.where(is_earning, None, amount_cells),
+        5: np.where(is_earning, amount_cells, None),
+        6: np.round(rng.normal(20_000, 5_000, rows), 2).astype(object),
+        7: list(dates.to_pydatetime()),
+        8: np.where(is_transfer, beneficiaries, None),
+        9: np.where(is_transfer, purposes, None),
+    }, dtype=object)
+    preamble = pd.DataFrame([['מספר חשבון 12-646-514385'] + [None] * 9, [None] * 10, [None] * 10, [None] * 10,
+                             BANK_COLUMNS], dtype=object)
+    return pd.concat([preamble, data], ignore_index=True)
+
+
+def make_cal_statement(rows: int, seed: int = SEED) -> pd.DataFrame:
+    """Raw CAL card export as read_excel(header=None) returns it: a title row, the header row, then object cells."""
+    rng = np.random.default_rng(seed + 1)
+    dates = make_dates(rows, rng, days=3650)
+    billing = dates + pd.to_timedelta(rng.integers(1, 35, rows), unit='D')
+    types, shares = zip(*CARD_TRANSACTION_TYPES)
+    kinds = np.array(types, dtype=object)[rng.choice(len(types), rows, p=shares)]
+    amounts = np.round(rng.lognormal(4.0, 1.1, rows), 2)
+    amounts = np.where(kinds == 'זיכוי', -amounts, amounts)
+    data = pd.DataFrame({
+        0: list(dates.to_pydatetime()),
+        1: make_merchant_names(rows, rng),
+        2: amounts.astype(object),
+        3: list(billing.to_pydatetime()),
+        4: kinds,
+        5: np.where(rng.random(rows) < 0.3, '3926', None),
+        6: None,
+        7: np.where(rng.random(rows) < 0.1, 'עסקה בחיוב מיידי', None),
+    }, dtype=object)
+    preamble = pd.DataFrame([['פירוט עסקאות לחשבון הפועלים'] + [None] * 7, CAL_COLUMNS], dtype=object)
+    return pd.concat([preamble, data], ignore_index=True)
+
+
+def make_category_cache(names: np.ndarray, seed: int = SEED) -> dict:
+    """Categorizations of about CACHED_SHARE of the distinct merchant names, in the transaction_kind.json format."""
+    rng = np.random.default_rng(seed + 2)
+    distinct = pd.unique(names)
+    cached = distinct[rng.random(len(distinct)) < CACHED_SHARE]
+    return {name: {'category': CATEGORIES[rng.integers(len(CATEGORIES))], 'confidence': '95%',
+                   'explanation': 'synthetic', 'confirm': bool(rng.random() < 0.5)}
+            for name in cached}
+
+
+def timed(func, *args, repeat: int = 1):
+    """(best seconds, result) of func(*args) over repeat runs."""
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def lookup_categories(store: CategoryStore, names: np.ndarray):
+    """The offline part of categorization.categorize_expenses: cache hits first, then the merchant index for the rest."""
+    distinct = list(dict.fromkeys(names))
+    misses = [name for name in distinct if name not in store]
+    index = MerchantIndex(store.categories)
+    inherited = {name: match for name in misses if (match := index.lookup(name))}
+    return len(distinct), len(distinct) - len(misses), len(inherited)
+
+
+def categorize_mock(cache_path: str, names: np.ndarray):
+    """categorization.categorize_expenses with the offline mock provider, on a copy of the cache.
+
+    The merchant index and local classifier are skipped (category_cache_lookup times the index), since
+    they would answer every synthetic miss and leave nothing for the provider.
+    """
+    run_cache = cache_path.replace('.json', '_run.json')
+    shutil.copyfile(cache_path, run_cache)
+    if os.path.exists(run_cache + LOG_SUFFIX):
+        os.remove(run_cache + LOG_SUFFIX)
+    provider = MockProvider()
+    # The per-batch progress lines would drown out the benchmark's own
+    with contextlib.redirect_stdout(io.StringIO()):
+        categorized = categorize_expenses(list(dict.fromkeys(names)), provider, fuzzy_match=False, local_model=False,
+                                          cache_path=run_cache)
+    return len(categorized), sum(provider.requested.values())
+
+
+def run_size(rows: int, repeat: int, workdir: str) -> list:
+    results = []
+
+    def record(stage, seconds, **extra):
+        results.append({'rows': rows, 'stage': stage, 'seconds': round(seconds, 6), **extra})
+        print(f"{rows:>10}  {stage:<26}{seconds:>10.3f}s")
+
+    raw_bank = make_bank_statement(rows)
+    seconds, ledger = timed(process_data, raw_bank, repeat=repeat)
+    record('ingest_bank', seconds, memory_bytes=int(ledger.memory_usage(deep=True).sum()))
+    del raw_bank
+
+    raw_cal = make_cal_statement(rows)
+    seconds, card = timed(parse_cal_statement, raw_cal, repeat=repeat)
+    record('ingest_cal', seconds, memory_bytes=int(card.memory_usage(deep=True).sum()))
+    del raw_cal
+
+    seconds, _ = timed(earning_expenses, ledger, repeat=repeat)
+    record('earning_expenses', seconds)
+    seconds, _ = timed(earning_expenses_by_period, ledger, repeat=repeat)
+    record('earning_expenses_by_period', seconds)
+    seconds, grouped = timed(group_by_business, card, repeat=repeat)
+    record('group_by_business', seconds, businesses=len(grouped) - 1)
+
+    names = card['שם בית עסק'].to_numpy()
+    cache_path = os.path.join(workdir, f'transaction_kind_{rows}.json')
+    with open(cache_path, 'w', encoding='utf-8') as f:
+        json.dump(make_category_cache(names), f, ensure_ascii=False)
+    seconds, store = timed(CategoryStore, cache_path, repeat=repeat)
+    record('category_cache_load', seconds, entries=len(store.categories))
+    seconds, (distinct, hits, inherited) = timed(lookup_categories, store, names, repeat=repeat)
+    record('category_cache_lookup', seconds, names=distinct, cache_hits=hits, merchant_index_hits=inherited)
+    seconds, (categorized, requested) = timed(categorize_mock, cache_path, names, repeat=repeat)
+    record('categorize_mock', seconds, categorized=categorized, requested=requested)
+
+    partials = period_partials(ledger)
+    start_date, end_date = ledger['תאריך'].min().date(), ledger['תאריך'].max().date()
+    output_folder = os.path.join(workdir, f'reports_{rows}')
+    os.makedirs(output_folder, exist_ok=True)
+    seconds, metrics = timed(write_partials, partials, output_folder, start_date, end_date, repeat=repeat)
+    record('export_csv', seconds, files=len(metrics), bytes=sum(m['bytes'] for m in metrics),
+           write_seconds=round(sum(m['seconds'] for m in metrics), 6))
+    return results
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'seed': SEED,
+    }
+
+
+def compare(results: list, previous_path: str):
+    with open(previous_path, 'r', encoding='utf-8') as f:
+        previous = {(r['rows'], r['stage']): r['seconds'] for r in json.load(f)['results']}
+    print(f"\n{'rows':>10}  {'stage':<26}{'before s':>10}{'after s':>10}{'ratio':>8}")
+    for result in results:
+        before = previous.get((result['rows'], result['stage']))
+        if not before:
+            continue
+        ratio = result['seconds'] / before
+        flag = '  regression' if ratio > REGRESSION_RATIO else ''
+        print(f"{result['rows']:>10}  {result['stage']:<26}{before:>10.3f}{result['seconds']:>10.3f}{ratio:>7.2f}x{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline stages on synthetic ledgers.')
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=DEFAULT_SIZES, help='ledger sizes')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per stage; the fastest is reported')
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON file for the results')
+    parser.add_argument('--compare', help='previous results JSON to compare against')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            results.extend(run_size(SIZES[size], args.repeat, workdir))
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'environment': environment(), 'results': results}, f, ensure_ascii=False, indent=2)
+    print(f"Results written to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,22 @@
+import numpy as np
 import pandas as pd
 import re
-from typing import Dict
+from functools import lru_cache
+from typing import Dict, Iterator, List, Tuple
 
+try:
+    from instrumentation import instrumented
+except ImportError:  # imported as new_v.calculations from the parent folder
+    from new_v.instrumentation import instrumented
 
+DATE_RANGE_FORMAT = '%d/%m/%y'
+NO_DETAILS = '(ללא פרטים)'
+AMOUNT_COLUMNS = {'earnings': 'זכות', 'expenses': 'חובה'}
+# Statement amounts are in agorot, so a sum rounded to 2 decimals is exact
+AMOUNT_DECIMALS = 2
+
+
+@instrumented()
 def earning_expenses(data: pd.DataFrame) -> Dict[str, pd.DataFrame]:
     earnings_data = data[data['זכות'].notna()].copy()
     expenses_data = data[data['חובה'].notna()].copy()
@@ -24,23 +38,270 @@ def earning_expenses(data: pd.DataFrame) -> Dict[str, pd.DataFrame]:
     }
 
 
-def group_by_operation_and_details(data: pd.DataFrame, amount_col: str) -> pd.DataFrame:
-    data['פרטים'] = data['פרטים'].fillna('(ללא פרטים)')
-    grouped = data.groupby(['הפעולה', 'פרטים']).agg({
-        'תאריך': format_date_range,
-        amount_col: ['sum', 'count']
+@instrumented()
+def earning_expenses_by_period(data: pd.DataFrame, date_format: str = DATE_RANGE_FORMAT) -> Dict[str, Dict]:
+    """Run earning_expenses for the whole range, every year and every month in one pass.
+
+    The rows are grouped once by (month, הפעולה, פרטים); yearly and overall reports are
+    rolled up from those monthly partials instead of re-filtering the frame per period.
+    Returns {'all': dfs, 'years': {year: dfs}, 'months': {Period: dfs}} where each dfs has
+    the same keys and frames as earning_expenses.
+    """
+    return reports_from_partials(period_partials(data), date_format)
+
+
+@instrumented()
+def period_partials(data: pd.DataFrame, position_offset: int = 0) -> Dict:
+    """Monthly partials of a frame, or of one chunk of a statement when position_offset is its first row."""
+    months = data['תאריך'].dt.to_period('M')
+    partials = {'months': pd.Index(months.dropna().unique())}
+    for kind, amount_col in AMOUNT_COLUMNS.items():
+        mask = data[amount_col].notna().to_numpy()
+        positions = position_offset + np.flatnonzero(mask)
+        partials[kind] = _monthly_partials(data[mask], months[mask], amount_col, positions)
+    return partials
+
+
+def merge_period_partials(partials_list: List[Dict]) -> Dict:
+    """Combine the partials of several chunks into one set of monthly partials."""
+    merged = {'months': partials_list[0]['months'].append([p['months'] for p in partials_list[1:]]).unique()}
+    for kind in AMOUNT_COLUMNS:
+        combined = pd.concat([p[kind] for p in partials_list], ignore_index=True)
+        merged[kind] = _roll_up(combined, combined['period'])
+    return merged
+
+
+def reports_from_partials(partials: Dict, date_format: str = DATE_RANGE_FORMAT) -> Dict[str, Dict]:
+    reports = {'all': {}, 'years': {}, 'months': {}}
+    for level, period, rows in period_groups(partials):
+        dfs = period_report(rows, date_format)
+        if level == 'all':
+            reports['all'] = dfs
+        else:
+            reports[level][period] = dfs
+    return reports
+
+
+def period_groups(partials: Dict, roll_up: bool = True) -> Iterator[Tuple[str, object, Dict[str, pd.DataFrame]]]:
+    """Yield (level, period, {kind: partial rows}) for every month, in order, every year and the overall range.
+
+    Each period gets only its own rows, so its report can be built on its own (see period_report),
+    in this process or another one. With roll_up=False, years and the overall range get their monthly
+    rows as they are, for the receiver to pass through roll_up_period.
+    """
+    month_periods = sorted(partials['months'])
+    year_periods = sorted({period.year for period in month_periods})
+    slices = {}
+    for kind in AMOUNT_COLUMNS:
+        # Details are cleaned once here; every period (and roll-up) carries the cleaned column along
+        monthly = partials[kind].assign(clean=clean_text_column(partials[kind]['פרטים']))
+        years = monthly['period'].dt.year
+        levels = {
+            'months': (monthly, monthly['period'], month_periods),
+            'years': (_roll_up(monthly, years), None, year_periods) if roll_up else (monthly, years, year_periods),
+            'all': (_roll_up(monthly, pd.Series('all', index=monthly.index)), None, ['all']) if roll_up
+            else (monthly, pd.Series('all', index=monthly.index), ['all']),
+        }
+        for level, (rows, keys, periods) in levels.items():
+            keys = rows['period'] if keys is None else keys
+            by_period = dict(tuple(rows.groupby(keys, sort=False))) if not rows.empty else {}
+            for period in periods:
+                slices.setdefault((level, period), {})[kind] = by_period.get(period, rows.iloc[:0])
+    for (level, period), rows in slices.items():
+        yield level, period, rows
+
+
+def roll_up_period(level: str, period, rows: Dict[str, pd.DataFrame]) -> Dict[str, pd.DataFrame]:
+    """Roll the monthly rows of a year or of the overall range (from period_groups(roll_up=False)) up to it."""
+    if level == 'months':
+        return rows
+    return {kind: kind_rows if kind_rows.empty else _roll_up(kind_rows, pd.Series(period, index=kind_rows.index))
+            for kind, kind_rows in rows.items()}
+
+
+def period_report(rows: Dict[str, pd.DataFrame], date_format: str = DATE_RANGE_FORMAT) -> Dict[str, pd.DataFrame]:
+    """Build one period's earning_expenses frames from its partial rows."""
+    dfs = {}
+    for kind, amount_col in AMOUNT_COLUMNS.items():
+        kind_rows = rows[kind]
+        if kind_rows.empty:
+            empty_long, empty_short = _empty_reports(amount_col, kind_rows['amount'].dtype)
+            dfs[f'l_{kind}'] = empty_long.copy()
+            dfs[f's_{kind}'] = empty_short.copy()
+        else:
+            dfs[f'l_{kind}'] = _long_report(kind_rows, amount_col, date_format)
+            dfs[f's_{kind}'] = _short_report(kind_rows, amount_col)
+    return dfs
+
+
+@lru_cache(maxsize=None)
+def _empty_reports(amount_col: str, amount_dtype) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    empty = pd.DataFrame({
+        'תאריך': pd.Series(dtype='datetime64[ns]'),
+        'הפעולה': pd.Series(dtype=object),
+        'פרטים': pd.Series(dtype=object),
+        amount_col: pd.Series(dtype=amount_dtype)
+    })
+    return group_by_operation_and_details(empty, amount_col), group_by_operation(empty.copy(), amount_col)
+
+
+def _monthly_partials(data: pd.DataFrame, months: pd.Series, amount_col: str, positions) -> pd.DataFrame:
+    frame = pd.DataFrame({
+        'period': months,
+        'הפעולה': data['הפעולה'],
+        'פרטים': fill_details(data['פרטים']),
+        'first': data['תאריך'],
+        'last': data['תאריך'],
+        'amount': data[amount_col],
+        'count': data[amount_col],
+        'position': positions,
+    })
+    partials = frame.groupby(['period', 'הפעולה', 'פרטים'], observed=True).agg({
+        'first': 'min',
+        'last': 'max',
+        'amount': 'sum',
+        'count': 'count',
+        'position': 'min'
     }).reset_index()
-    grouped.columns = ['הפעולה', 'פרטים', 'תאריך', amount_col, 'מספר טרנזקציות']
-    grouped['מספר טרנזקציות'] = grouped['מספר טרנזקציות'].astype(int)
+    # One row per group, so plain object keys are cheap here and let chunks with different categories merge
+    return partials.astype({'הפעולה': object, 'פרטים': object})
+
+
+def _roll_up(partials: pd.DataFrame, period: pd.Series) -> pd.DataFrame:
+    aggregations = {
+        'first': 'min',
+        'last': 'max',
+        'amount': 'sum',
+        'count': 'sum',
+        'position': 'min'
+    }
+    if 'clean' in partials.columns:
+        # Cleaned details depend only on פרטים, which is part of the key
+        aggregations['clean'] = 'first'
+    return partials.drop(columns='period').groupby([period.rename('period'), 'הפעולה', 'פרטים']).agg(
+        aggregations).reset_index()
+
+
+def _long_report(rows: pd.DataFrame, amount_col: str, date_format: str) -> pd.DataFrame:
+    grouped = rows[['הפעולה', 'פרטים']].reset_index(drop=True)
+    grouped['תאריך'] = format_date_ranges(rows['first'], rows['last'], rows['count'], date_format).values
+    grouped['מספר טרנזקציות'] = rows['count'].astype(int).values
+    grouped[amount_col] = report_amounts(rows['amount'])
+    return grouped
+
+
+def _short_report(rows: pd.DataFrame, amount_col: str) -> pd.DataFrame:
+    # Walk the partials in row order so the details keep the same first-seen order as group_by_operation
+    rows = rows.sort_values('position')
+    amounts = rows.groupby('הפעולה')['amount'].sum()
+    details = join_unique_details(rows['הפעולה'], rows['clean'])
+    return pd.DataFrame({
+        'הפעולה': amounts.index,
+        amount_col: report_amounts(amounts),
+        'פרטים': details.reindex(amounts.index, fill_value='').values
+    })
+
+
+def format_date_ranges(first: pd.Series, last: pd.Series, count: pd.Series,
+                       date_format: str = DATE_RANGE_FORMAT) -> pd.Series:
+    """Vectorized format_date_range over per-group first/last dates and row counts."""
+    # Statements span few distinct days, so strftime runs once per day rather than once per group
+    codes, days = pd.factorize(pd.concat([first, last], ignore_index=True))
+    labels = np.append(np.asarray(days.strftime(date_format), dtype=object), np.nan)
+    first_str = pd.Series(labels[codes[:len(first)]], index=first.index)
+    last_str = pd.Series(labels[codes[len(first):]], index=first.index)
+    return first_str.where(count == 1, first_str + ' - ' + last_str)
+
+
+def group_by_operation_and_details(data: pd.DataFrame, amount_col: str) -> pd.DataFrame:
+    data['פרטים'] = fill_details(data['פרטים'])
+    grouped = data.groupby(['הפעולה', 'פרטים'], observed=True).agg(
+        first=('תאריך', 'min'),
+        last=('תאריך', 'max'),
+        amount=(amount_col, 'sum'),
+        count=(amount_col, 'count')
+    ).reset_index().astype({'הפעולה': object, 'פרטים': object})
+    grouped['תאריך'] = format_date_ranges(grouped['first'], grouped['last'], grouped['count'])
+    grouped['מספר טרנזקציות'] = grouped['count'].astype(int)
+    grouped[amount_col] = report_amounts(grouped['amount'])
     return grouped[['הפעולה', 'פרטים', 'תאריך', 'מספר טרנזקציות', amount_col]]
 
 
 def group_by_operation(data: pd.DataFrame, amount_col: str) -> pd.DataFrame:
-    return data.groupby('הפעולה').agg({
-        amount_col: 'sum',
-        'פרטים': lambda x: ', '.join(filter(None, set(clean_text(i) for i in x)))
+    amounts = data.groupby('הפעולה', observed=True)[amount_col].sum()
+    details = join_unique_details(data['הפעולה'], clean_text_column(data['פרטים']))
+    return pd.DataFrame({
+        'הפעולה': amounts.index.astype(object),
+        amount_col: report_amounts(amounts),
+        'פרטים': details.reindex(amounts.index, fill_value='').values
+    })
+
+
+@instrumented()
+def group_by_business(data) -> pd.DataFrame:
+    # Group by 'שם בית עסק'
+    grouped = data.groupby('שם בית עסק').agg({
+        'תאריך עסקה': lambda x: f"{x.min().strftime('%Y-%m-%d')} - {x.max().strftime('%Y-%m-%d')}" if x.nunique() > 1 else x.iloc[0].strftime('%Y-%m-%d'),
+        'סכום בש"ח': ['count', 'sum']
     }).reset_index()
 
+    # Flatten column names
+    grouped.columns = ['שם בית עסק', 'תאריכי ביצוע', 'מספר עסקאות', 'סכום כולל']
+
+    # Ensure 'סכום כולל' is of type float
+    grouped['סכום כולל'] = grouped['סכום כולל'].astype(float)
+
+    # Round 'סכום כולל' to two decimal places
+    grouped['סכום כולל'] = grouped['סכום כולל'].round(2)
+
+    # Reorder columns
+    grouped = grouped[['שם בית עסק', 'תאריכי ביצוע', 'מספר עסקאות', 'סכום כולל']]
+    grouped = grouped.sort_values(by='סכום כולל', ascending=False)
+    # Calculate the total sum of 'סכום כולל'
+    total_sum = grouped['סכום כולל'].sum().round(1)
+
+    # Append a row with the total sum and empty values for the other columns
+    total_row = pd.DataFrame([['', '', '', total_sum]], columns=grouped.columns)
+    grouped = pd.concat([grouped, total_row], ignore_index=True)
+
+    return grouped
+
+
+def join_unique_details(operations: pd.Series, details: pd.Series) -> pd.Series:
+    """Join the distinct non-empty details of each operation, in first-seen order."""
+    unique = pd.DataFrame({'הפעולה': operations, 'פרטים': details}).drop_duplicates()
+    unique = unique[unique['פרטים'] != '']
+    return unique.groupby('הפעולה', observed=True)['פרטים'].agg(', '.join)
+
+
+def fill_details(details: pd.Series) -> pd.Series:
+    """Fill missing details with NO_DETAILS, also for category columns (see data_processing.LEDGER_SCHEMA)."""
+    if isinstance(details.dtype, pd.CategoricalDtype) and NO_DETAILS not in details.cat.categories:
+        categories = details.cat.categories.append(pd.Index([NO_DETAILS]))
+        try:
+            # Keep the categories sorted, so groupby orders the groups as it would plain strings
+            categories = categories.sort_values()
+        except TypeError:
+            pass
+        details = details.cat.set_categories(categories)
+    return details.fillna(NO_DETAILS)
+
+
+def report_amounts(amounts: pd.Series) -> np.ndarray:
+    """Summed amounts as report values: rounded to agorot, and whole sums as ints like the statement's amounts.
+
+    The report columns stay object dtype, so 115 is written as '115' rather than '115.0' and the
+    scripts' round_and_clean leaves the amounts as they are.
+    """
+    values = amounts.to_numpy()
+    if values.dtype.kind != 'f':
+        return values.astype(object)
+    values = np.round(values, AMOUNT_DECIMALS)
+    whole = np.isfinite(values) & (values == np.round(values))
+    result = values.astype(object)
+    result[whole] = values[whole].astype(np.int64)
+    return result
+
 
 def add_total_row(df: pd.DataFrame, sum_column: str) -> pd.DataFrame:
     total = round_numbers(df[sum_column].sum())
@@ -58,12 +319,7 @@ def clean_dataframe(df: pd.DataFrame):
         if df[col].dtype in ['float64', 'int64']:
             df[col] = df[col].apply(round_numbers)
         elif col == 'פרטים':
-            df[col] = df[col].apply(lambda x: clean_text(x) if x != '(ללא פרטים)' else x)
-
-
-def format_date_range(dates):
-    return dates.iloc[0].strftime('%d/%m/%y') if len(
-        dates) == 1 else f"{dates.min().strftime('%d/%m/%y')} - {dates.max().strftime('%d/%m/%y')}"
+            df[col] = clean_text_column(df[col]).where(df[col] != NO_DETAILS, df[col])
 
 
 def round_numbers(x):
@@ -77,3 +333,21 @@ def clean_text(text):
         text = ' '.join(text.split())
         text = re.sub(r'\s+([,.])', r'\1', text)
     return text
+
+
+def clean_text_column(texts: pd.Series) -> pd.Series:
+    """Vectorized clean_text over a whole column; each distinct value is cleaned only once."""
+    if isinstance(texts.dtype, pd.CategoricalDtype):
+        # A category column already holds each distinct value once
+        codes, uniques = texts.cat.codes.to_numpy(), texts.cat.categories.to_numpy(dtype=object)
+    elif not pd.api.types.is_object_dtype(texts) and not pd.api.types.is_string_dtype(texts):
+        return texts.astype(object).fillna('')
+    else:
+        codes, uniques = pd.factorize(texts)
+    uniques = pd.Series(uniques, dtype=object)
+    cleaned = (uniques.str.replace(r'\s+', ' ', regex=True)
+               .str.strip()
+               .str.replace(r'\s+([,.])', r'\1', regex=True))
+    # Missing values get code -1, which picks the trailing '' entry
+    cleaned = np.append(cleaned.where(cleaned.notna(), uniques).to_numpy(), '')
+    return pd.Series(cleaned[codes], index=texts.index, dtype=object)
@@ -1,19 +1,190 @@
+import csv
+import re
+import numpy as np
 import pandas as pd
 from datetime import datetime
+from typing import Iterator, List
 
+try:
+    from instrumentation import instrumented, stage
+except ImportError:  # imported as new_v.data_processing from the parent folder
+    from new_v.instrumentation import instrumented, stage
 
+CHUNK_ROWS = 50_000
+CARD_DATE_FORMATS = ['%d/%m/%y', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d']
+
+# Column types of the normalized ledger, applied once when a statement is read
+LEDGER_SCHEMA = {
+    'תאריך': 'datetime',
+    'תאריך ערך': 'datetime',
+    'הפעולה': 'category',
+    'פרטים': 'category',
+    'לטובת': 'category',
+    'עבור': 'category',
+    'חובה': 'amount',
+    'זכות': 'amount',
+    "יתרה בש''ח": 'amount',
+    'אסמכתא': 'number',
+}
+
+
+@instrumented()
 def process_data(data: pd.DataFrame) -> pd.DataFrame:
     # Find the header row and clean the data
-    header_row = data[data.eq('תאריך').any(axis=1)].index[0]
+    with stage('find_header_row'):
+        header_row = data[data.eq('תאריך').any(axis=1)].index[0]
     data_cleaned = data.iloc[header_row:].reset_index(drop=True)
     data_cleaned.columns = data_cleaned.iloc[0]
     data_cleaned = data_cleaned[1:].reset_index(drop=True)
 
-    # Convert date column to datetime
-    data_cleaned['תאריך'] = pd.to_datetime(data_cleaned['תאריך'])
+    return normalize_ledger(data_cleaned)
 
-    return data_cleaned
+
+@instrumented()
+def normalize_ledger(data: pd.DataFrame) -> pd.DataFrame:
+    """Give the statement columns compact types (see LEDGER_SCHEMA).
+
+    Read with header=None, every column is object dtype: amounts are boxed Python numbers and
+    operations/details repeated strings. Typed columns take a fraction of the memory and let the
+    groupbys in calculations.py run on their fast paths. Columns not in the schema are left as they are.
+    """
+    data = data.copy()
+    for column, kind in LEDGER_SCHEMA.items():
+        if column not in data.columns:
+            continue
+        if kind == 'datetime':
+            data[column] = pd.to_datetime(data[column])
+        elif kind == 'category':
+            data[column] = data[column].astype('category')
+        elif kind == 'amount':
+            data[column] = pd.to_numeric(data[column], errors='coerce').astype('float64')
+        else:
+            data[column] = pd.to_numeric(data[column], errors='coerce')
+    return data
+
+
+def iter_statement_chunks(file_path: str, chunk_rows: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """Yield the processed statement in frames of at most chunk_rows rows.
+
+    Excel files are streamed with openpyxl's read-only mode and CSV exports with chunked read_csv,
+    so only one chunk is held in memory. The header row is located once, as in process_data.
+    """
+    if file_path.lower().endswith('.csv'):
+        yield from _iter_csv_chunks(file_path, chunk_rows)
+    else:
+        yield from _iter_excel_chunks(file_path, chunk_rows)
+
+
+def _iter_excel_chunks(file_path: str, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        header = None
+        rows = []
+        for row in workbook.active.iter_rows(values_only=True):
+            if header is None:
+                if 'תאריך' in row:
+                    header = list(row)
+                continue
+            rows.append(tuple(_excel_value(value) for value in row))
+            if len(rows) == chunk_rows:
+                yield _process_chunk(rows, header)
+                rows = []
+        if rows:
+            yield _process_chunk(rows, header)
+    finally:
+        workbook.close()
+
+
+def _iter_csv_chunks(file_path: str, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    with open(file_path, 'r', encoding='utf-8-sig', newline='') as f:
+        header_row = next(i for i, row in enumerate(csv.reader(f)) if 'תאריך' in row)
+    for chunk in pd.read_csv(file_path, skiprows=header_row, chunksize=chunk_rows, encoding='utf-8-sig'):
+        yield normalize_ledger(chunk)
+
+
+def _excel_value(value):
+    # Match read_excel: empty cells become NaN and whole floats become ints
+    if value is None or value == '':
+        return np.nan
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _process_chunk(rows: List[tuple], header: list) -> pd.DataFrame:
+    # Same types as process_data, where the header row is read together with the data
+    return normalize_ledger(pd.DataFrame(rows, columns=header, dtype=object))
 
 
 def filter_data_by_date(data: pd.DataFrame, start_date: datetime, end_date: datetime) -> pd.DataFrame:
     return data[(data['תאריך'].dt.date >= start_date) & (data['תאריך'].dt.date <= end_date)]
+
+
+@instrumented()
+def parse_cal_statement(data: pd.DataFrame) -> pd.DataFrame:
+    # Find the first row that contains 'תאריך' (assuming this is the header row)
+    header_row = data[data.astype(str).apply(lambda x: x.str.contains('תאריך', na=False)).any(axis=1)].index[0]
+
+    # Select the data from the header row onwards
+    data_cleaned = data.iloc[header_row:].reset_index(drop=True)
+
+    # Clean up column names: remove newlines and extra spaces
+    data_cleaned.columns = [clean_cell(col) for col in data_cleaned.iloc[0]]
+    data_cleaned = data_cleaned.iloc[1:].reset_index(drop=True)
+
+    # Clean up all cells: remove newlines and extra spaces
+    for col in data_cleaned.columns:
+        data_cleaned[col] = clean_column(data_cleaned[col])
+
+    # Convert the 'תאריך עסקה' column to datetime
+    if 'תאריך עסקה' in data_cleaned.columns:
+        data_cleaned['תאריך עסקה'] = parse_dates(data_cleaned['תאריך עסקה'])
+
+    # Convert the 'מועד חיוב' column to datetime
+    if 'מועד חיוב' in data_cleaned.columns:
+        data_cleaned['מועד חיוב'] = parse_dates(data_cleaned['מועד חיוב'])
+
+    # Remove rows after the last date
+    last_date_row = data_cleaned['תאריך עסקה'].last_valid_index()
+    if last_date_row is not None:
+        data_cleaned = data_cleaned.iloc[:last_date_row + 1]
+
+    # Remove any remaining empty rows
+    data_cleaned = data_cleaned.dropna(how='all')
+    data_cleaned['סכום בש"ח'] = pd.to_numeric(data_cleaned['סכום בש"ח'], errors='coerce')
+    return data_cleaned
+
+
+def clean_cell(x):
+    if pd.isna(x):
+        return x
+    return re.sub(r'\s+', ' ', str(x).replace('\n', ' ')).strip()
+
+
+def clean_column(values: pd.Series) -> pd.Series:
+    # Same as mapping clean_cell, but each distinct value is cleaned once with vectorized string ops
+    codes, uniques = pd.factorize(values)
+    cleaned = pd.Series(uniques, dtype=object).astype(str).str.replace(r'\s+', ' ', regex=True).str.strip()
+    # Missing values get code -1, which picks the trailing NaN entry
+    cleaned = np.append(cleaned.to_numpy(), np.nan)
+    return pd.Series(cleaned[codes], index=values.index, dtype=object)
+
+
+@instrumented()
+def parse_dates(values: pd.Series) -> pd.Series:
+    # Try each format on the whole column, passing only the rows still unparsed on to the next one
+    parsed = pd.Series(pd.NaT, index=values.index, dtype='datetime64[ns]')
+    remaining = values.notna()
+    for fmt in CARD_DATE_FORMATS:
+        if not remaining.any():
+            break
+        attempt = pd.to_datetime(values[remaining], format=fmt, errors='coerce')
+        parsed[attempt.index] = attempt
+        remaining &= parsed.isna()
+
+    failed = int(remaining.sum())
+    if failed:
+        print(f"Warning: Could not parse {failed} value(s) in '{values.name}' as dates")
+    return parsed
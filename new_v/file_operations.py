@@ -1,5 +1,181 @@
+import importlib.util
+import io
+import os
+import queue
+import threading
+import time
 import pandas as pd
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+try:
+    from instrumentation import instrumented, stage
+except ImportError:  # imported as new_v.file_operations from the parent folder
+    from new_v.instrumentation import instrumented, stage
+
+# Empty columns between the reports laid out on one sheet
+SHEET_GAP = 2
+# Frames waiting for the background writer before export() blocks, bounding the memory they hold
+MAX_PENDING_WRITES = 32
 
 
 def export_to_csv(df: pd.DataFrame, file_path: str):
-    df.to_csv(file_path, index=False, encoding='utf-8-sig')
+    write_csv(df, file_path)
+
+
+def write_csv(df: pd.DataFrame, file_path: str) -> int:
+    return write_bytes(df.to_csv(index=False).encode('utf-8-sig'), file_path)
+
+
+def write_jsonl(df: pd.DataFrame, file_path: str) -> int:
+    return write_bytes(df.to_json(orient='records', lines=True, force_ascii=False, date_format='iso').encode('utf-8'),
+                       file_path)
+
+
+def write_parquet(df: pd.DataFrame, file_path: str) -> int:
+    buffer = io.BytesIO()
+    numeric_object_columns(df).to_parquet(buffer, index=False)
+    return write_bytes(buffer.getvalue(), file_path)
+
+
+def write_bytes(data: bytes, file_path: str) -> int:
+    # The file is serialized in memory first and written with one call
+    with open(file_path, 'wb') as f:
+        f.write(data)
+    return len(data)
+
+
+def numeric_object_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Object columns holding only numbers (the report amounts mix ints and floats) as float64, for Parquet."""
+    converted = {}
+    for col in df.columns[df.dtypes == object]:
+        numbers = pd.to_numeric(df[col], errors='coerce')
+        if numbers.notna().sum() == df[col].notna().sum():
+            converted[col] = numbers.astype('float64')
+    return df.assign(**converted) if converted else df
+
+
+# Backend name -> (file extension, writer returning the bytes written)
+EXPORT_BACKENDS = {
+    'csv': ('.csv', write_csv),
+    'jsonl': ('.jsonl', write_jsonl),
+    'parquet': ('.parquet', write_parquet),
+}
+
+
+def check_backend(backend: str):
+    if backend not in EXPORT_BACKENDS:
+        raise ValueError(f"Unknown export backend '{backend}', expected one of {', '.join(EXPORT_BACKENDS)}")
+    if backend == 'parquet' and not any(importlib.util.find_spec(m) for m in ('pyarrow', 'fastparquet')):
+        raise ImportError("The parquet backend needs pyarrow or fastparquet: pip install pyarrow")
+
+
+class ReportExporter:
+    """Writes report frames with one of EXPORT_BACKENDS and records each file's size and write time.
+
+    With background=True, export() hands the frame to a writer thread through a bounded queue and
+    returns, so the next period's reports are computed while earlier ones are written. close() waits
+    for the pending writes and re-raises the first error a write hit.
+    """
+
+    def __init__(self, backend: str = 'csv', background: bool = False, max_pending: int = MAX_PENDING_WRITES):
+        check_backend(backend)
+        self.backend = backend
+        self.extension, self.writer = EXPORT_BACKENDS[backend]
+        self.metrics = []
+        self.error = None
+        self.queue = None
+        self.thread = None
+        if background:
+            self.queue = queue.Queue(maxsize=max_pending)
+            self.thread = threading.Thread(target=self._run, name='report-writer', daemon=True)
+            self.thread.start()
+
+    def export(self, df: pd.DataFrame, file_path: str):
+        if self.error is not None:
+            raise self.error
+        if self.queue is None:
+            self._write(df, file_path)
+        else:
+            self.queue.put((df, file_path))
+
+    def close(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _write(self, df: pd.DataFrame, file_path: str):
+        start = time.perf_counter()
+        with stage(f'export_{self.backend}', len(df)) as record:
+            size = self.writer(df, file_path)
+            record['bytes'] = size
+        self.metrics.append({'path': file_path, 'bytes': size, 'seconds': time.perf_counter() - start})
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            # After a failed write the rest are skipped; close() reports the error
+            if self.error is None:
+                try:
+                    self._write(*item)
+                except Exception as e:
+                    self.error = e
+
+
+def summarize_metrics(metrics: List[Dict]) -> Dict:
+    """Totals of ReportExporter metrics, plus the slowest files."""
+    return {
+        'files': len(metrics),
+        'bytes': sum(m['bytes'] for m in metrics),
+        'seconds': sum(m['seconds'] for m in metrics),
+        'slowest': sorted(metrics, key=lambda m: -m['seconds'])[:5],
+    }
+
+
+@instrumented('export_xlsx')
+def export_workbook(sheets: Iterable[Tuple[str, Dict[str, pd.DataFrame]]], file_path: str) -> int:
+    """Write (sheet title, {name: frame}) pairs into one .xlsx, each sheet's frames side by side.
+
+    openpyxl's write-only mode streams every appended row to disk, so memory stays flat however
+    many sheets there are. The workbook is written next to file_path and then moved into place.
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    for title, frames in sheets:
+        sheet = workbook.create_sheet(title)
+        for row in side_by_side_rows(list(frames.values())):
+            sheet.append(row)
+    tmp_path = file_path + '.tmp'
+    workbook.save(tmp_path)
+    os.replace(tmp_path, file_path)
+    return os.path.getsize(file_path)
+
+
+def side_by_side_rows(frames: List[pd.DataFrame]) -> Iterator[list]:
+    """Rows of the frames laid out next to each other, headers first and SHEET_GAP empty columns apart."""
+    blocks = [[list(df.columns)] + cell_values(df) for df in frames]
+    for i in range(max((len(block) for block in blocks), default=0)):
+        row = []
+        for j, (df, block) in enumerate(zip(frames, blocks)):
+            if j:
+                row.extend([None] * SHEET_GAP)
+            row.extend(block[i] if i < len(block) else [None] * len(df.columns))
+        yield row
+
+
+def cell_values(df: pd.DataFrame) -> List[list]:
+    # Missing values become empty cells; openpyxl would write NaN as an invalid number
+    values = df.to_numpy(dtype=object)
+    values[pd.isna(values)] = None
+    return values.tolist()
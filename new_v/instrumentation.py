@@ -0,0 +1,186 @@
+# instrumentation.py
+#
+# Per-stage timings of the pipeline: wall time, rows, peak traced memory and API call latencies, kept
+# as a trace that can be summarized or saved as JSON (chrome://tracing / Perfetto format), plus an
+# optional cProfile of the whole run. Off by default; a disabled stage costs one flag check.
+
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, List, Optional
+
+
+class Tracer:
+    """Collects stage and API call records while enabled. Stages nest, per thread."""
+
+    def __init__(self):
+        self.enabled = False
+        self.memory = False
+        self.profiler = None
+        self.records = []
+        self.api_calls = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.origin = time.perf_counter()
+
+    def enable(self, memory: bool = False, profile: bool = False):
+        """Start recording; memory traces allocations (slows the run down), profile runs cProfile as well."""
+        self.records, self.api_calls = [], []
+        self.origin = time.perf_counter()
+        self.memory = memory
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if profile:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+        if self.profiler is not None:
+            self.profiler.disable()
+        if self.memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    @contextmanager
+    def stage(self, name: str, rows: Optional[int] = None):
+        stack = self.local.__dict__.setdefault('stack', [])
+        record = {'stage': name, 'rows': rows, 'depth': len(stack), 'thread': threading.get_ident()}
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            # The enclosing stage keeps the peak reached so far, since this one resets it
+            if stack:
+                stack[-1]['_peak'] = max(stack[-1]['_peak'], peak)
+            tracemalloc.reset_peak()
+            record.update(_start_memory=current, _peak=current)
+        stack.append(record)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['start'] = start - self.origin
+            record['seconds'] = time.perf_counter() - start
+            stack.pop()
+            if self.memory:
+                peak = max(record.pop('_peak'), tracemalloc.get_traced_memory()[1])
+                record['peak_memory_bytes'] = peak - record.pop('_start_memory')
+                if stack:
+                    stack[-1]['_peak'] = max(stack[-1]['_peak'], peak)
+            with self.lock:
+                self.records.append(record)
+
+    def api_call(self, provider: str, seconds: float, status: Optional[int] = None, error: Optional[str] = None):
+        with self.lock:
+            self.api_calls.append({'provider': provider, 'start': time.perf_counter() - seconds - self.origin,
+                                   'seconds': seconds, 'status': status, 'error': error})
+
+    def summary(self) -> Dict:
+        """Totals per stage (calls, seconds, rows, largest peak) and per API provider (calls, errors, latency)."""
+        stages = {}
+        for record in self.records:
+            total = stages.setdefault(record['stage'], {'calls': 0, 'seconds': 0.0, 'rows': None})
+            total['calls'] += 1
+            total['seconds'] += record['seconds']
+            if record['rows'] is not None:
+                total['rows'] = (total['rows'] or 0) + record['rows']
+            if 'peak_memory_bytes' in record:
+                total['peak_memory_bytes'] = max(total.get('peak_memory_bytes', 0), record['peak_memory_bytes'])
+        api = {}
+        for provider in dict.fromkeys(call['provider'] for call in self.api_calls):
+            latencies = sorted(call['seconds'] for call in self.api_calls if call['provider'] == provider)
+            api[provider] = {
+                'calls': len(latencies),
+                'errors': sum(1 for call in self.api_calls
+                              if call['provider'] == provider and (call['error'] or (call['status'] or 200) >= 400)),
+                'mean_seconds': sum(latencies) / len(latencies),
+                'p95_seconds': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+                'max_seconds': latencies[-1],
+            }
+        return {'stages': stages, 'api': api}
+
+    def write_trace(self, path: str):
+        """Save the records as Chrome trace events, with the summary alongside."""
+        events = [{'name': record['stage'], 'cat': 'stage', 'ph': 'X', 'pid': os.getpid(), 'tid': record['thread'],
+                   'ts': record['start'] * 1e6, 'dur': record['seconds'] * 1e6,
+                   'args': {key: value for key, value in record.items()
+                            if key not in ('stage', 'thread', 'start', 'seconds')}}
+                  for record in self.records]
+        events += [{'name': call['provider'], 'cat': 'api', 'ph': 'X', 'pid': os.getpid(), 'tid': 0,
+                    'ts': call['start'] * 1e6, 'dur': call['seconds'] * 1e6,
+                    'args': {'status': call['status'], 'error': call['error']}}
+                   for call in self.api_calls]
+        # Thread names for the viewer; API calls share a row of their own
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        events += [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid,
+                    'args': {'name': names.get(tid, str(tid)) if tid else 'API calls'}}
+                   for tid in {event['tid'] for event in events}]
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'summary': self.summary()}, f, ensure_ascii=False, indent=1)
+
+    def write_profile(self, path: str, top: int = 25) -> str:
+        """Save the cProfile stats (for pstats or snakeviz) and return the top functions by cumulative time."""
+        self.profiler.dump_stats(path)
+        text = io.StringIO()
+        pstats.Stats(self.profiler, stream=text).sort_stats('cumulative').print_stats(top)
+        return text.getvalue()
+
+
+tracer = Tracer()
+
+
+def stage(name: str, rows: Optional[int] = None):
+    """Context manager timing a block as a stage; set record['rows'] on the yielded record once known."""
+    if not tracer.enabled:
+        return nullcontext({})
+    return tracer.stage(name, rows)
+
+
+def instrumented(name: Optional[str] = None, rows: Optional[Callable] = None):
+    """Decorator timing every call of a function as a stage (named after the function by default).
+
+    rows(args, result) gives the rows processed; by default it's the length of the first sized argument.
+    """
+    def decorate(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            with tracer.stage(stage_name) as record:
+                result = func(*args, **kwargs)
+                record['rows'] = rows(args, result) if rows else input_rows(args)
+            return result
+        return wrapper
+    return decorate
+
+
+def input_rows(args: tuple) -> Optional[int]:
+    for arg in args:
+        if hasattr(arg, '__len__') and not isinstance(arg, (str, bytes)):
+            return len(arg)
+    return None
+
+
+def record_api_call(provider: str, seconds: float, status: Optional[int] = None, error: Optional[str] = None):
+    if tracer.enabled:
+        tracer.api_call(provider, seconds, status, error)
+
+
+def format_summary(summary: Dict) -> List[str]:
+    lines = [f"{'stage':<28}{'calls':>7}{'seconds':>10}{'rows':>12}{'peak MB':>10}"]
+    for name, total in sorted(summary['stages'].items(), key=lambda item: -item[1]['seconds']):
+        peak = total.get('peak_memory_bytes')
+        lines.append(f"{name:<28}{total['calls']:>7}{total['seconds']:>10.3f}{total['rows'] or '':>12}"
+                     f"{'' if peak is None else f'{peak / 1e6:.1f}':>10}")
+    for provider, api in summary['api'].items():
+        lines.append(f"API {provider}: {api['calls']} calls, {api['errors']} errors, mean {api['mean_seconds']:.2f}s, "
+                     f"p95 {api['p95_seconds']:.2f}s, max {api['max_seconds']:.2f}s")
+    return lines
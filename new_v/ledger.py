@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+from typing import Tuple
+from data_processing import normalize_ledger
+
+SOURCE_COLUMN = 'מקור'
+BANK_SOURCE = 'בנק'
+CARD_SOURCE = 'כאל'
+# The bank statement's operation for a CAL card payment
+CARD_OPERATION = 'כאל'
+LEDGER_COLUMNS = ['תאריך', 'הפעולה', 'פרטים', 'חובה', 'זכות', SOURCE_COLUMN]
+# Days between a card billing date and the bank debit that still count as the same payment
+MATCH_TOLERANCE_DAYS = 3
+
+
+def build_ledger(bank: pd.DataFrame, card: pd.DataFrame) -> pd.DataFrame:
+    """Merge the bank statement and the CAL card export into one ledger on the bank's columns.
+
+    Card charges become 'כאל' rows with the business name as פרטים, dated by the purchase rather
+    than the billing date. A bank 'כאל' debit that pays a card billing is replaced by that billing's
+    itemized charges, so nothing is counted twice. Billings with no matching debit are added only
+    when they fall outside the bank statement's dates; inside them, the debit may have been paid
+    differently (e.g. together with another card), so the bank's lump sum is kept instead. Charges
+    with no billing date yet are added too, since no bank debit can have paid them.
+    """
+    card_rows = card_to_ledger(card)
+    debit_rows, billing_dates = match_card_debits(bank, card)
+
+    billed = card_rows['מועד חיוב']
+    tolerance = pd.Timedelta(days=MATCH_TOLERANCE_DAYS)
+    outside_bank = (billed < bank['תאריך'].min() - tolerance) | (billed > bank['תאריך'].max() + tolerance)
+    matched = billed.isin(billing_dates)
+    unbilled = billed.isna()
+    kept = matched | outside_bank | unbilled
+    unmatched = card_rows[~kept]
+    print(f"Replaced {len(debit_rows)} {CARD_OPERATION} debits with {int(matched.sum())} card charges")
+    if unbilled.any():
+        print(f"Added {int(unbilled.sum())} card charges that have no billing date yet")
+    if not unmatched.empty:
+        print(f"Warning: {unmatched['מועד חיוב'].nunique()} card billing(s) had no matching bank debit; "
+              f"kept the bank's lump sums instead of their {len(unmatched)} charges")
+
+    ledger = pd.concat([
+        bank.drop(index=debit_rows).assign(**{SOURCE_COLUMN: BANK_SOURCE}),
+        card_rows[kept].assign(**{SOURCE_COLUMN: CARD_SOURCE}),
+    ], ignore_index=True)[LEDGER_COLUMNS]
+    # Newest first like the bank statement; the stable sort keeps each source's own order within a day
+    ledger = ledger.sort_values('תאריך', ascending=False, kind='stable', ignore_index=True)
+    ledger = normalize_ledger(ledger)
+    ledger[SOURCE_COLUMN] = ledger[SOURCE_COLUMN].astype('category')
+    return ledger
+
+
+def card_to_ledger(card: pd.DataFrame) -> pd.DataFrame:
+    """Card charges on the ledger columns (charges as חובה, refunds as זכות), keeping the billing date."""
+    card = card[card['תאריך עסקה'].notna() & card['סכום בש"ח'].notna()]
+    amounts = card['סכום בש"ח'].to_numpy(dtype=float)
+    return pd.DataFrame({
+        'תאריך': card['תאריך עסקה'].to_numpy(),
+        'הפעולה': CARD_OPERATION,
+        'פרטים': card['שם בית עסק'].to_numpy(),
+        'חובה': np.where(amounts > 0, amounts, np.nan),
+        'זכות': np.where(amounts < 0, -amounts, np.nan),
+        'מועד חיוב': card['מועד חיוב'].to_numpy(),
+    })
+
+
+def match_card_debits(bank: pd.DataFrame, card: pd.DataFrame) -> Tuple[pd.Index, pd.Series]:
+    """Pair the bank's card debits with the card billings they paid.
+
+    Both sides are sorted by date and joined with merge_asof on the exact amount in agorot, taking
+    the nearest billing date within MATCH_TOLERANCE_DAYS. Returns the matched bank row labels and
+    the billing dates they paid.
+    """
+    totals = card.groupby('מועד חיוב')['סכום בש"ח'].sum()
+    billings = pd.DataFrame({'billing_date': totals.index, 'agorot': to_agorot(totals)})
+    debits = bank[(bank['הפעולה'] == CARD_OPERATION) & bank['חובה'].notna()]
+    debits = pd.DataFrame({'date': debits['תאריך'].to_numpy(), 'agorot': to_agorot(debits['חובה']),
+                           'row': debits.index})
+    if billings.empty or debits.empty:
+        return pd.Index([]), pd.Series([], dtype='datetime64[ns]')
+
+    matches = pd.merge_asof(debits.sort_values('date'), billings.sort_values('billing_date'),
+                            left_on='date', right_on='billing_date', by='agorot', direction='nearest',
+                            tolerance=pd.Timedelta(days=MATCH_TOLERANCE_DAYS)).dropna(subset=['billing_date'])
+    # A billing is paid once: of several equal debits near it, keep the closest
+    gap = (matches['date'] - matches['billing_date']).abs()
+    matches = matches.loc[gap.sort_values(kind='stable').index].drop_duplicates('billing_date')
+    return pd.Index(matches['row']), matches['billing_date']
+
+
+def to_agorot(amounts: pd.Series) -> np.ndarray:
+    return np.round(np.asarray(amounts, dtype=float) * 100).astype(np.int64)
+
+
+def check_ledger():
+    """Merge a small hand-made statement and card export and assert every charge ends up where it should:
+    a matched billing replaces its debit, an unmatched one keeps the bank's lump sum, and unbilled
+    charges and billings after the statement are added."""
+    day = pd.Timestamp
+    bank = normalize_ledger(pd.DataFrame({
+        'תאריך': [day('2024-04-02'), day('2024-03-10'), day('2024-03-02')],
+        'הפעולה': [CARD_OPERATION, 'משכורת', CARD_OPERATION],
+        'פרטים': [None, 'מעסיק', None],
+        'חובה': [999.0, np.nan, 150.0],
+        'זכות': [np.nan, 1000.0, np.nan],
+    }))
+    card = pd.DataFrame({
+        'תאריך עסקה': [day('2024-02-10'), day('2024-02-15'), day('2024-03-05'), day('2024-04-20'),
+                       day('2024-05-01')],
+        'שם בית עסק': ['paid A', 'paid B', 'unmatched C', 'unbilled D', 'later E'],
+        'סכום בש"ח': [100.0, 50.0, 70.0, 30.0, 20.0],
+        'מועד חיוב': [day('2024-03-02'), day('2024-03-02'), day('2024-04-02'), pd.NaT, day('2024-06-02')],
+    })
+    ledger = build_ledger(bank, card)
+    card_details = ledger.loc[ledger[SOURCE_COLUMN] == CARD_SOURCE, 'פרטים'].astype(str)
+    assert sorted(card_details) == ['later E', 'paid A', 'paid B', 'unbilled D'], list(card_details)
+    assert ledger['חובה'].sum() == 999 + 100 + 50 + 30 + 20, ledger['חובה'].sum()
+    assert ledger['זכות'].sum() == 1000, ledger['זכות'].sum()
+    print("Ledger merge check passed")
+
+
+if __name__ == "__main__":
+    check_ledger()
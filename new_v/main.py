@@ -1,21 +1,108 @@
 # main.py
 
-import pandas as pd
-from data_processing import process_data
-from report_generation import generate_reports
-from utils import get_date_range_input
+import argparse
+import json
+import os
+from datetime import datetime
+from instrumentation import format_summary, tracer
+from pipeline import (CATEGORIES_FILE, OUTPUT_FOLDER, OUTPUT_FORMATS, REPORT_LEVELS, category_counts, check_sources,
+                      run_pipeline)
 
 
-def main():
-    # Load and process data
-    raw_data = pd.read_excel('../bank.xlsx', header=None)
-    processed_data = process_data(raw_data)
+def parse_date(value: str):
+    try:
+        return datetime.strptime(value, "%d/%m/%Y").date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid date '{value}', expected DD/MM/YYYY")
 
-    # Get date range from user
-    start_date, end_date = get_date_range_input()
 
-    # Generate reports
-    generate_reports(processed_data, start_date, end_date)
+def main():
+    parser = argparse.ArgumentParser(description='Generate earnings and expenses reports from bank statements.')
+    parser.add_argument('--input', nargs='+', default=['../bank.xlsx'],
+                        help='bank statements (.xlsx, or .csv exports with --stream); each gets its own subfolder '
+                             'of --output when there are several')
+    parser.add_argument('--card', help='CAL card export (.xlsx) to merge in, itemizing the bank\'s card debits')
+    parser.add_argument('--start', type=parse_date, help='first date to report (DD/MM/YYYY)')
+    parser.add_argument('--end', type=parse_date, help='last date to report (DD/MM/YYYY)')
+    parser.add_argument('--interactive', action='store_true',
+                        help='ask for the dates not given with --start/--end (by default the whole statement is reported)')
+    parser.add_argument('--granularity', nargs='+', choices=REPORT_LEVELS, default=list(REPORT_LEVELS),
+                        help='report levels to write: the whole range, every year and/or every month')
+    parser.add_argument('--output', default=OUTPUT_FOLDER, help='folder for the reports')
+    parser.add_argument('--stream', action='store_true',
+                        help='read the statement in chunks instead of loading it whole (for very large histories)')
+    parser.add_argument('--chunk-rows', type=int, help='rows per chunk in --stream mode (default 50,000)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='processes that build and write the period reports (0 = one per CPU)')
+    parser.add_argument('--format', nargs='+', choices=OUTPUT_FORMATS, default=['csv'],
+                        help='csv, jsonl or parquet: a file per report under --output; '
+                             'xlsx: one workbook with a sheet per period')
+    parser.add_argument('--background-writes', action='store_true',
+                        help='write report files on a thread while the next reports are built')
+    parser.add_argument('--export-metrics', help='save the size and write time of every exported file to this JSON file')
+    parser.add_argument('--full', action='store_true',
+                        help='regenerate every report instead of only the periods whose transactions changed')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='time every stage (rows, API calls) and save the trace as JSON (chrome://tracing)')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='also record each stage\'s peak memory with tracemalloc (makes the run much slower)')
+    parser.add_argument('--profile', metavar='FILE', help='run under cProfile and save the stats to this file')
+    parser.add_argument('--list-categories', nargs='?', const=CATEGORIES_FILE, metavar='CACHE',
+                        help='print how many businesses the categorization cache holds per category and exit')
+    args = parser.parse_args()
+
+    if args.list_categories:
+        # Reads only the JSON cache, without importing pandas
+        counts = category_counts(args.list_categories)
+        for category, count in counts.most_common():
+            print(f"{count:>6}  {category}")
+        print(f"{sum(counts.values()):>6}  businesses in {args.list_categories}")
+        return
+
+    if args.card and args.stream:
+        parser.error('--card cannot be combined with --stream')
+    if args.card and len(args.input) > 1:
+        parser.error('--card can only be merged into a single --input statement')
+    if 'parquet' in args.format:
+        from file_operations import check_backend
+        try:
+            check_backend('parquet')
+        except ImportError as e:
+            parser.error(str(e))
+    sources = [(args.input[0], args.card)] if args.card else args.input
+    try:
+        check_sources(sources, args.stream)
+    except (ValueError, FileNotFoundError) as e:
+        parser.error(str(e))
+    start_date, end_date = args.start, args.end
+    if args.interactive:
+        # Only the dates missing from the flags are asked for
+        from utils import get_date_input
+        if start_date is None:
+            start_date = get_date_input("Enter start date (DD/MM/YYYY) or press Enter for all dates: ")
+        if end_date is None:
+            end_date = get_date_input("Enter end date (DD/MM/YYYY) or press Enter for all dates: ")
+
+    if args.trace or args.trace_memory or args.profile:
+        tracer.enable(memory=args.trace_memory, profile=bool(args.profile))
+    metrics = run_pipeline(sources, start_date, end_date, args.granularity, args.format, args.output,
+                           args.workers or os.cpu_count(), incremental=not args.full,
+                           background=args.background_writes, stream=args.stream, chunk_rows=args.chunk_rows)
+    if tracer.enabled:
+        tracer.disable()
+        print('\n'.join(format_summary(tracer.summary())))
+        if args.trace:
+            tracer.write_trace(args.trace)
+        if args.profile:
+            print(tracer.write_profile(args.profile))
+
+    from file_operations import summarize_metrics
+    files = [file for source_metrics in metrics.values() for file in source_metrics]
+    summary = summarize_metrics(files)
+    print(f"Wrote {summary['files']} files, {summary['bytes'] / 1e6:.1f} MB in {summary['seconds']:.2f}s of writing")
+    if args.export_metrics:
+        with open(args.export_metrics, 'w', encoding='utf-8') as f:
+            json.dump({'format': args.format, 'summary': summary, 'files': files}, f, ensure_ascii=False, indent=2)
 
     print("All reports have been generated successfully.")
 
@@ -23,20 +110,3 @@ def main():
 if __name__ == "__main__":
     main()
 
-# data_processing.py
-
-
-
-# report_generation.py
-
-
-# calculations.py
-
-
-
-# file_operations.py
-
-
-
-# utils.py
-
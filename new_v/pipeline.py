@@ -0,0 +1,158 @@
+# pipeline.py
+#
+# run_pipeline writes the reports of any number of statements without prompting, so runs can be scripted,
+# scheduled or profiled. pandas and the modules built on it are imported on the first call rather than
+# here, which keeps importing this module (and the quick commands of main.py) fast.
+
+import os
+import sys
+from collections import Counter
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+from instrumentation import stage
+
+# report_generation.LEVEL_ORDER and EXPORT_FORMATS, listed here so they are known without importing pandas
+REPORT_LEVELS = ('all', 'years', 'months')
+OUTPUT_FORMATS = ('csv', 'jsonl', 'parquet', 'xlsx')
+OUTPUT_FOLDER = 'all_reports'
+# Statement files each reader accepts: load_statement uses read_excel, --stream openpyxl or read_csv
+EXCEL_EXTENSIONS = ('.xlsx', '.xlsm', '.xls')
+STREAM_EXTENSIONS = ('.xlsx', '.xlsm', '.csv')
+# The categorization scripts and their cache live in the parent folder
+PARENT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CATEGORIES_FILE = os.path.join(PARENT_FOLDER, 'transaction_kind.json')
+
+# A bank statement, or a (bank statement, CAL card export) pair merged into one ledger
+Source = Union[str, Tuple[str, str]]
+
+
+def run_pipeline(sources: Iterable[Source], start: Optional[date] = None, end: Optional[date] = None,
+                 granularity: Sequence[str] = REPORT_LEVELS, outputs: Sequence[str] = ('csv',),
+                 output_folder: str = OUTPUT_FOLDER, workers: int = 1, incremental: bool = True,
+                 background: bool = False, stream: bool = False,
+                 chunk_rows: Optional[int] = None) -> Dict[str, List[Dict]]:
+    """Write the reports of every source and return each one's export metrics, keyed by source name.
+
+    Only the transactions from start to end are reported; either defaults to the statement's own
+    first or last date. granularity picks report levels from REPORT_LEVELS and outputs the formats
+    from OUTPUT_FORMATS; each source is read and grouped once for all of them. With several sources,
+    each one's reports go to a subfolder of output_folder named after its statement file (see source_names).
+    """
+    levels = check_choices(granularity, REPORT_LEVELS, 'report level')
+    formats = check_choices(outputs, OUTPUT_FORMATS, 'output format')
+    sources = list(sources)
+    # All sources are checked up front, so a bad one doesn't fail the run after others were written
+    check_sources(sources, stream)
+
+    from file_operations import EXPORT_BACKENDS, check_backend
+    for export_format in formats:
+        if export_format in EXPORT_BACKENDS:
+            check_backend(export_format)
+
+    metrics = {}
+    for source, name in zip(sources, source_names(sources)):
+        folder = output_folder if len(sources) == 1 else os.path.join(output_folder, name)
+        os.makedirs(folder, exist_ok=True)
+        print(f"Reporting {name} into {folder}")
+        with stage('run_source'):
+            metrics[name] = run_source(source, start, end, levels, formats, folder, workers, incremental,
+                                       background, stream, chunk_rows)
+    return metrics
+
+
+def run_source(source: Source, start: Optional[date], end: Optional[date], levels: List[str], formats: List[str],
+               output_folder: str, workers: int = 1, incremental: bool = True, background: bool = False,
+               stream: bool = False, chunk_rows: Optional[int] = None) -> List[Dict]:
+    from calculations import period_partials
+    from data_processing import CHUNK_ROWS, filter_data_by_date, iter_statement_chunks, parse_cal_statement, process_data
+    from report_generation import partials_from_chunks, write_partials
+    from report_manifest import month_hashes
+    from statement_cache import load_statement
+
+    bank_path, card_path = source if isinstance(source, tuple) else (source, None)
+    if stream:
+        # Chunk by chunk, so memory stays flat however long the statement is
+        grouped = partials_from_chunks(iter_statement_chunks(bank_path, chunk_rows or CHUNK_ROWS), start, end)
+        if grouped is None:
+            print(f"No transactions in {bank_path} between the given dates")
+            return []
+        partials, hashes, first_date, last_date = grouped
+    else:
+        data = load_statement(bank_path, process_data)
+        if card_path:
+            from ledger import build_ledger
+            data = build_ledger(data, load_statement(card_path, parse_cal_statement))
+        data = filter_data_by_date(data, start or date.min, end or date.max)
+        if data.empty:
+            print(f"No transactions in {bank_path} between the given dates")
+            return []
+        partials, hashes = period_partials(data), month_hashes(data)
+        first_date, last_date = data['תאריך'].min().date(), data['תאריך'].max().date()
+
+    # A subset of the levels is passed on as such; None writes (and records in the manifest) all of them
+    levels = None if set(REPORT_LEVELS) <= set(levels) else set(levels)
+    metrics = []
+    for export_format in formats:
+        with stage(f'write_reports_{export_format}'):
+            metrics.extend(write_partials(partials, output_folder, start or first_date, end or last_date, workers,
+                                          hashes, incremental, export_format, background, levels))
+    return metrics
+
+
+def check_choices(values: Sequence[str], choices: Sequence[str], kind: str) -> List[str]:
+    values = [values] if isinstance(values, str) else list(values)
+    unknown = [value for value in values if value not in choices]
+    if unknown or not values:
+        raise ValueError(f"Unknown {kind} {', '.join(map(repr, unknown)) or '(none given)'}, "
+                         f"expected some of {', '.join(choices)}")
+    return list(dict.fromkeys(values))
+
+
+def check_sources(sources: Sequence[Source], stream: bool = False):
+    """Raise ValueError for a source the chosen reader can't read, FileNotFoundError for a missing file."""
+    if not sources:
+        raise ValueError('No statements given')
+    for source in sources:
+        bank_path, card_path = source if isinstance(source, tuple) else (source, None)
+        if stream and card_path:
+            raise ValueError('A card export cannot be merged into a streamed statement')
+        for path, extensions in ((bank_path, STREAM_EXTENSIONS if stream else EXCEL_EXTENSIONS),
+                                 (card_path, EXCEL_EXTENSIONS)):
+            if path is None:
+                continue
+            if not path.lower().endswith(extensions):
+                hint = '' if stream or not path.lower().endswith('.csv') else ' (CSV exports need --stream)'
+                raise ValueError(f"Can't read {path}: expected one of {', '.join(extensions)}{hint}")
+            if not os.path.isfile(path):
+                raise FileNotFoundError(f"No such statement: {path}")
+
+
+def source_names(sources: Sequence[Source]) -> List[str]:
+    """A distinct name per source: its statement file's name, prefixed with the folders that tell
+    apart statements of the same name (a/bank.xlsx, b/bank.xlsx -> a_bank, b_bank)."""
+    paths = [os.path.abspath(source[0] if isinstance(source, tuple) else source) for source in sources]
+    stems = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+    stem_counts = Counter(stems)
+    names = []
+    for path, stem in zip(paths, stems):
+        if stem_counts[stem] == 1:
+            names.append(stem)
+            continue
+        common = os.path.commonpath([os.path.dirname(other) for other, other_stem in zip(paths, stems)
+                                     if other_stem == stem])
+        names.append(os.path.relpath(os.path.splitext(path)[0], common).replace(os.sep, '_'))
+    # The same statement given twice still gets two names
+    seen = Counter()
+    for i, name in enumerate(names):
+        seen[name] += 1
+        if seen[name] > 1:
+            names[i] = f'{name}_{seen[name]}'
+    return names
+
+
+def category_counts(path: str = CATEGORIES_FILE) -> Counter:
+    """Businesses per category in the categorization cache (transaction_kind.json and its log)."""
+    if PARENT_FOLDER not in sys.path:
+        sys.path.insert(0, PARENT_FOLDER)
+    from category_store import CategoryStore
+    return Counter(value.get('category', 'Other') for value in CategoryStore(path).categories.values())
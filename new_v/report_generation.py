@@ -1,49 +1,246 @@
 import pandas as pd
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
 import os
-from typing import Dict
-from calculations import earning_expenses
-from file_operations import export_to_csv
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from calculations import (AMOUNT_COLUMNS, merge_period_partials, period_groups, period_partials, period_report,
+                          roll_up_period)
+from data_processing import filter_data_by_date
+from file_operations import EXPORT_BACKENDS, ReportExporter, export_workbook
+from report_manifest import (changed_months, finish_month_digests, load_manifest, month_hashes, save_manifest,
+                             update_month_digests)
 
+EXPORT_FORMATS = list(EXPORT_BACKENDS) + ['xlsx']
+OUTPUT_FOLDER = 'all_reports'
+WORKBOOK_FILE = 'reports.xlsx'
+LEVEL_ORDER = {'all': 0, 'years': 1, 'months': 2}
 
-def generate_reports(data: pd.DataFrame, start_date: datetime, end_date: datetime):
-    output_folder = 'all_reports'
+
+def generate_reports(data: pd.DataFrame, start_date: datetime, end_date: datetime, workers: int = 1,
+                     incremental: bool = True, export_format: str = 'csv', background: bool = False,
+                     output_folder: str = OUTPUT_FOLDER, levels: Optional[Set[str]] = None) -> List[Dict]:
+    os.makedirs(output_folder, exist_ok=True)
+
+    # Group every transaction once and roll months up into years and the overall range
+    return write_partials(period_partials(data), output_folder, start_date, end_date, workers, month_hashes(data),
+                          incremental, export_format, background, levels)
+
+
+def generate_reports_from_chunks(chunks: Iterable[pd.DataFrame], start_date: datetime = None,
+                                 end_date: datetime = None, workers: int = 1, incremental: bool = True,
+                                 export_format: str = 'csv', background: bool = False,
+                                 output_folder: str = OUTPUT_FOLDER, levels: Optional[Set[str]] = None) -> List[Dict]:
+    """The reports of generate_reports from a statement read chunk by chunk (see partials_from_chunks)."""
     os.makedirs(output_folder, exist_ok=True)
 
-    # Generate overall report
-    generate_overall_report(data, output_folder, start_date, end_date)
+    grouped = partials_from_chunks(chunks, start_date, end_date)
+    if grouped is None:
+        return []
+    partials, hashes, first_date, last_date = grouped
+    return write_partials(partials, output_folder, start_date or first_date, end_date or last_date, workers,
+                          hashes, incremental, export_format, background, levels)
+
+
+def partials_from_chunks(chunks: Iterable[pd.DataFrame], start_date: datetime = None,
+                   end_date: datetime = None) -> Optional[Tuple[Dict, Dict[str, str], date, date]]:
+    """(partials, month hashes, first date, last date) of a statement read chunk by chunk, or None if it's empty.
+
+    Each chunk is reduced to monthly partials and merged into the running totals, so memory
+    stays bounded by the number of (month, הפעולה, פרטים) groups rather than by the row count.
+    """
+    merged, pending = None, []
+    merged_rows, pending_rows = 0, 0
+    rows_seen = 0
+    first_date, last_date = None, None
+    digests = {}
+    for chunk in chunks:
+        chunk = filter_data_by_date(chunk, start_date or date.min, end_date or date.max)
+        if chunk.empty:
+            continue
+        chunk_partials = period_partials(chunk, rows_seen)
+        update_month_digests(digests, chunk)
+        rows_seen += len(chunk)
+        first_date = min(filter(None, [first_date, chunk['תאריך'].min().date()]))
+        last_date = max(filter(None, [last_date, chunk['תאריך'].max().date()]))
+
+        # Merge once the pending chunks outgrow the running totals, so each group is re-aggregated
+        # a logarithmic rather than linear number of times
+        pending.append(chunk_partials)
+        pending_rows += sum(len(chunk_partials[kind]) for kind in AMOUNT_COLUMNS)
+        if pending_rows >= merged_rows:
+            merged = merge_period_partials(([merged] if merged else []) + pending)
+            merged_rows = sum(len(merged[kind]) for kind in AMOUNT_COLUMNS)
+            pending, pending_rows = [], 0
+
+    if merged is None and not pending:
+        return None
+    partials = merge_period_partials(([merged] if merged else []) + pending)
+    return partials, finish_month_digests(digests), first_date, last_date
+
+
+def write_partials(partials: Dict, output_folder: str, start_date: datetime, end_date: datetime, workers: int = 1,
+                   hashes: Optional[Dict[str, str]] = None, incremental: bool = False, export_format: str = 'csv',
+                   background: bool = False, levels: Optional[Set[str]] = None) -> List[Dict]:
+    """Write the reports of the partials and record the month hashes in the output folder's manifest.
+
+    export_format is one of EXPORT_BACKENDS (a file per report) or 'xlsx' (one workbook, always
+    written whole, with no manifest). With incremental, only the reports whose months' hashes changed
+    since the last run of the same format are written. With background, files are written on a
+    thread while the next reports are built. levels limits the reports to some of LEVEL_ORDER
+    ('all', 'years', 'months'). Returns the per-file write metrics.
+    """
+    if export_format == 'xlsx':
+        return write_workbook(partials, os.path.join(output_folder, WORKBOOK_FILE), start_date, end_date, workers,
+                              levels)
+
+    exporter = ReportExporter(export_format, background=background and workers <= 1)
+    periods = None
+    if hashes is not None and incremental:
+        periods = stale_periods(partials, load_manifest(output_folder, export_format), hashes, output_folder,
+                                start_date, end_date, exporter.extension)
+    if levels is not None:
+        periods = {(level, period) for level, period in (all_periods(partials) if periods is None else periods)
+                   if level in levels}
+    if hashes is not None and incremental:
+        print(f"Updating {len(periods)} of {len(all_periods(partials))} reports whose transactions changed")
+
+    with exporter:
+        if workers > 1:
+            exporter.metrics.extend(write_reports_parallel(partials, output_folder, start_date, end_date, workers,
+                                                           periods, export_format))
+        else:
+            for level, period, rows in period_groups(partials):
+                if periods is None or (level, period) in periods:
+                    export_period_report(period_report(rows), report_paths(
+                        output_folder, level, period, start_date, end_date, exporter.extension), exporter)
+
+    # The manifest vouches for every report, so a run that skipped some levels leaves it as it was
+    if hashes is not None and (levels is None or set(LEVEL_ORDER) <= set(levels)):
+        overall_report = report_paths(output_folder, 'all', None, start_date, end_date, exporter.extension)[0]
+        save_manifest(output_folder, hashes, os.path.basename(overall_report), export_format)
+    return exporter.metrics
+
+
+def all_periods(partials: Dict) -> Set[Tuple[str, object]]:
+    months = set(partials['months'])
+    return ({('months', month) for month in months} | {('years', month.year) for month in months}
+            | {('all', 'all')})
+
+
+def stale_periods(partials: Dict, manifest: Dict, hashes: Dict[str, str], output_folder: str,
+                  start_date: datetime, end_date: datetime, extension: str = '.csv') -> Set[Tuple[str, object]]:
+    """(level, period) of the reports to rewrite: changed months, the years they fall in and the overall range."""
+    changed = changed_months(manifest.get('months', {}), hashes)
+    changed_years = {month[:4] for month in changed}
+    stale = set()
+    for level, period in all_periods(partials):
+        paths = report_paths(output_folder, level, period, start_date, end_date, extension)
+        if level == 'months':
+            outdated = str(period) in changed
+        elif level == 'years':
+            outdated = str(period) in changed_years
+        else:
+            outdated = bool(changed) or manifest.get('overall_report') != os.path.basename(paths[0])
+        # Reports deleted since the last run are written again as well
+        if outdated or not all(os.path.exists(path) for path in paths):
+            stale.add((level, period))
+    return stale
+
+
+def write_reports_parallel(partials: Dict, output_folder: str, start_date: datetime, end_date: datetime,
+                           workers: int, periods: Optional[Set[Tuple[str, object]]] = None,
+                           export_format: str = 'csv') -> List[Dict]:
+    """Build and write every period's reports (or only the given (level, period)s) across a process pool.
+
+    Workers get only the monthly partial rows of their period, which are small next to the statement,
+    roll them up themselves and write the same files as the serial path of write_partials. Returns their write metrics.
+    """
+    extension = EXPORT_BACKENDS[export_format][0]
+    tasks = [(level, period, rows, report_paths(output_folder, level, period, start_date, end_date, extension),
+              export_format)
+             for level, period, rows in period_groups(partials, roll_up=False)
+             if periods is None or (level, period) in periods]
+    # Largest periods first (the overall range, then years), so they don't end up running alone at the end
+    tasks.sort(key=lambda task: -sum(len(rows) for rows in task[2].values()))
+    metrics = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for future in [pool.submit(_write_period_report, *task) for task in tasks]:
+            metrics.extend(future.result())
+    return metrics
+
+
+def _write_period_report(level: str, period, rows: Dict[str, pd.DataFrame], paths: Tuple[str, str],
+                         export_format: str) -> List[Dict]:
+    exporter = ReportExporter(export_format)
+    export_period_report(_build_period_report(level, period, rows), paths, exporter)
+    return exporter.metrics
+
+
+def _build_period_report(level: str, period, rows: Dict[str, pd.DataFrame]) -> Dict[str, pd.DataFrame]:
+    return period_report(roll_up_period(level, period, rows))
+
+
+def write_workbook(partials: Dict, path: str, start_date: datetime, end_date: datetime,
+                   workers: int = 1, levels: Optional[Set[str]] = None) -> List[Dict]:
+    """Write every period's reports into one workbook: a sheet per period, the overall range first,
+    then the years and the months in order, each with its earnings and expenses side by side.
+    """
+    start = time.perf_counter()
+    size = export_workbook(((sheet_title(level, period, start_date, end_date),
+                             {'earnings': dfs['l_earnings'], 'expenses': dfs['l_expenses']})
+                            for level, period, dfs in iter_period_reports(partials, workers, levels)), path)
+    # Building the reports is interleaved with writing the sheets, so this includes both
+    return [{'path': path, 'bytes': size, 'seconds': time.perf_counter() - start}]
+
+
+def iter_period_reports(partials: Dict, workers: int = 1,
+                        levels: Optional[Set[str]] = None) -> Iterator[Tuple[str, object, Dict[str, pd.DataFrame]]]:
+    """Yield (level, period, reports) in sheet order, building the reports across a process pool if workers > 1."""
+    groups = sorted((group for group in period_groups(partials, roll_up=workers <= 1)
+                     if levels is None or group[0] in levels),
+                    key=lambda group: (LEVEL_ORDER[group[0]], str(group[1])))
+    if workers <= 1:
+        for level, period, rows in groups:
+            yield level, period, period_report(rows)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # map hands the reports back in submission order, while the sheets before them are being written
+        reports = pool.map(_build_period_report, *zip(*groups))
+        for (level, period, _), dfs in zip(groups, reports):
+            yield level, period, dfs
 
-    # Generate yearly reports
-    generate_yearly_reports(data, output_folder)
 
-    # Generate monthly reports
-    generate_monthly_reports(data, output_folder)
+def sheet_title(level: str, period, start_date: datetime = None, end_date: datetime = None) -> str:
+    if level == 'all':
+        return date_range_label(start_date, end_date)
+    return str(period)
 
 
-def generate_overall_report(data: pd.DataFrame, output_folder: str, start_date: datetime, end_date: datetime):
-    dfs = earning_expenses(data)
-    date_range = f"{start_date.strftime('%d-%m-%Y')}_to_{end_date.strftime('%d-%m-%Y')}"
-    export_to_csv(dfs["l_earnings"], os.path.join(output_folder, f'earnings_{date_range}.csv'))
-    export_to_csv(dfs["l_expenses"], os.path.join(output_folder, f'expenses_{date_range}.csv'))
+def date_range_label(start_date: datetime, end_date: datetime) -> str:
+    return f"{start_date.strftime('%d-%m-%Y')}_to_{end_date.strftime('%d-%m-%Y')}"
 
 
-def generate_yearly_reports(data: pd.DataFrame, output_folder: str):
-    for year in range(data['תאריך'].dt.year.min(), data['תאריך'].dt.year.max() + 1):
-        year_data = data[data['תאריך'].dt.year == year]
-        if not year_data.empty:
-            year_dfs = earning_expenses(year_data)
-            year_folder = os.path.join(output_folder, str(year))
-            os.makedirs(year_folder, exist_ok=True)
-            export_to_csv(year_dfs["l_earnings"], os.path.join(year_folder, f'earnings_{year}.csv'))
-            export_to_csv(year_dfs["l_expenses"], os.path.join(year_folder, f'expenses_{year}.csv'))
+def export_period_report(dfs: Dict[str, pd.DataFrame], paths: Tuple[str, str],
+                         exporter: Optional[ReportExporter] = None):
+    exporter = exporter or ReportExporter()
+    earnings_path, expenses_path = paths
+    os.makedirs(os.path.dirname(earnings_path), exist_ok=True)
+    exporter.export(dfs["l_earnings"], earnings_path)
+    exporter.export(dfs["l_expenses"], expenses_path)
 
 
-def generate_monthly_reports(data: pd.DataFrame, output_folder: str):
-    grouped = data.groupby(data['תאריך'].dt.to_period('M'))
-    for month, month_data in grouped:
-        monthly_dfs = earning_expenses(month_data)
-        month_folder = os.path.join(output_folder, month.strftime('%Y-%m'))
-        os.makedirs(month_folder, exist_ok=True)
-        export_to_csv(monthly_dfs["l_earnings"], os.path.join(month_folder, f'earnings_{month}.csv'))
-        export_to_csv(monthly_dfs["l_expenses"], os.path.join(month_folder, f'expenses_{month}.csv'))
+def report_paths(output_folder: str, level: str, period, start_date: datetime = None,
+                 end_date: datetime = None, extension: str = '.csv') -> Tuple[str, str]:
+    """(earnings, expenses) file paths of one period: 'all', a year or a month."""
+    if level == 'all':
+        date_range = date_range_label(start_date, end_date)
+        return (os.path.join(output_folder, f'earnings_{date_range}{extension}'),
+                os.path.join(output_folder, f'expenses_{date_range}{extension}'))
+    if level == 'years':
+        folder = os.path.join(output_folder, str(period))
+    else:
+        folder = os.path.join(output_folder, period.strftime('%Y-%m'))
+    return (os.path.join(folder, f'earnings_{period}{extension}'),
+            os.path.join(folder, f'expenses_{period}{extension}'))
 
@@ -0,0 +1,60 @@
+import hashlib
+import json
+import os
+import pandas as pd
+from typing import Dict, Set
+
+MANIFEST_FILE = 'manifest.json'
+# Bump when a change to the report code should regenerate every report
+MANIFEST_VERSION = 2
+REPORT_INPUT_COLUMNS = ['תאריך', 'הפעולה', 'פרטים', 'חובה', 'זכות']
+
+
+def month_hashes(data: pd.DataFrame) -> Dict[str, str]:
+    """Content hash of each month's report inputs, e.g. {'2024-05': 'ab12...'}."""
+    digests = {}
+    update_month_digests(digests, data)
+    return finish_month_digests(digests)
+
+
+def update_month_digests(digests: Dict, data: pd.DataFrame):
+    """Feed the rows of one frame (or statement chunk) into the running digest of their months, in row order."""
+    if data.empty:
+        return
+    row_hashes = pd.util.hash_pandas_object(data[REPORT_INPUT_COLUMNS], index=False).to_numpy()
+    months = data['תאריך'].dt.to_period('M')
+    for month, positions in months.groupby(months).indices.items():
+        digests.setdefault(str(month), hashlib.sha256()).update(row_hashes[positions].tobytes())
+
+
+def finish_month_digests(digests: Dict) -> Dict[str, str]:
+    return {month: digest.hexdigest() for month, digest in sorted(digests.items())}
+
+
+def changed_months(previous: Dict[str, str], current: Dict[str, str]) -> Set[str]:
+    """Months that were added, removed or whose rows changed since the previous run."""
+    return {month for month in previous.keys() | current.keys() if previous.get(month) != current.get(month)}
+
+
+def manifest_path(output_folder: str, export_format: str = 'csv') -> str:
+    # Each export format has its own manifest, as its reports are updated by its own runs
+    name = MANIFEST_FILE if export_format == 'csv' else f'manifest_{export_format}.json'
+    return os.path.join(output_folder, name)
+
+
+def load_manifest(output_folder: str, export_format: str = 'csv') -> Dict:
+    try:
+        with open(manifest_path(output_folder, export_format), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    return manifest if manifest.get('version') == MANIFEST_VERSION else {}
+
+
+def save_manifest(output_folder: str, month_hashes: Dict[str, str], overall_report: str, export_format: str = 'csv'):
+    manifest = {'version': MANIFEST_VERSION, 'overall_report': overall_report, 'months': month_hashes}
+    path = manifest_path(output_folder, export_format)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
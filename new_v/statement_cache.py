@@ -0,0 +1,172 @@
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from typing import Callable, Optional
+
+try:
+    from instrumentation import stage
+except ImportError:  # imported as new_v.statement_cache from the parent folder
+    from new_v.instrumentation import stage
+
+CACHE_FOLDER = '.statement_cache'
+# Version of the entry format; parser changes are picked up from the parser module's source instead
+CACHE_VERSION = 2
+
+
+def load_statement(file_path: str, parse: Callable[[pd.DataFrame], pd.DataFrame],
+                   cache_folder: str = CACHE_FOLDER) -> pd.DataFrame:
+    """Return parse(read_excel(file_path, header=None)), reusing the cached result while the file is unchanged.
+
+    A cache entry is keyed by the absolute path, the parser and the source of the module defining it
+    (so editing any helper the parser calls invalidates it), and is valid while the file's mtime and
+    size match. If they changed but the content hash did not (the file was copied or touched), the entry
+    is kept and only its metadata is refreshed.
+    """
+    source = os.path.abspath(file_path)
+    entry = os.path.join(cache_folder, _entry_name(source, parse))
+    stat = os.stat(source)
+    meta = _read_meta(entry)
+
+    if meta and meta['mtime_ns'] == stat.st_mtime_ns and meta['size'] == stat.st_size:
+        with stage('load_cached_statement'):
+            return _load_frame(entry, meta)
+
+    content_hash = file_hash(source)
+    if meta and meta['sha256'] == content_hash:
+        meta.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+        _write_meta(entry, meta)
+        with stage('load_cached_statement'):
+            return _load_frame(entry, meta)
+
+    with stage('read_excel') as record:
+        raw = pd.read_excel(source, header=None)
+        record['rows'] = len(raw)
+    data = parse(raw)
+    _save_frame(entry, data, {
+        'version': CACHE_VERSION,
+        'path': source,
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'sha256': content_hash,
+    })
+    return data
+
+
+def clear_cache(cache_folder: str = CACHE_FOLDER):
+    shutil.rmtree(cache_folder, ignore_errors=True)
+
+
+def file_hash(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _entry_name(source: str, parse: Callable) -> str:
+    parse = inspect.unwrap(parse)
+    key = f"{CACHE_VERSION}:{source}:{parse.__qualname__}:{_parser_hash(parse)}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def _parser_hash(parse: Callable) -> str:
+    # The parser's whole module (data_processing.py: its schema, date parsing and cleaning helpers), since
+    # the parser's own bytecode doesn't change when a function it calls does
+    try:
+        return file_hash(inspect.getsourcefile(parse))
+    except (TypeError, OSError):
+        code = parse.__code__
+        return f"{code.co_code.hex()}:{code.co_consts!r}"
+
+
+def _read_meta(entry: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(entry, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    return meta if meta.get('version') == CACHE_VERSION else None
+
+
+def _write_meta(entry: str, meta: dict):
+    tmp_path = os.path.join(entry, 'meta.json.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp_path, os.path.join(entry, 'meta.json'))
+
+
+def _save_frame(entry: str, data: pd.DataFrame, meta: dict):
+    """Store each column as its own .npy file: typed columns raw (mmap-able), text as fixed-width unicode.
+
+    Category columns are stored as their integer codes plus a file with the categories.
+    """
+    tmp_entry = entry + '.tmp'
+    shutil.rmtree(tmp_entry, ignore_errors=True)
+    os.makedirs(tmp_entry)
+
+    columns = []
+    for i, (name, values) in enumerate(data.items()):
+        kind = _column_kind(values)
+        if kind == 'array':
+            np.save(os.path.join(tmp_entry, f'{i}.npy'), values.to_numpy())
+        elif kind == 'category':
+            np.save(os.path.join(tmp_entry, f'{i}.npy'), values.cat.codes.to_numpy())
+            np.save(os.path.join(tmp_entry, f'{i}.categories.npy'), values.cat.categories.to_numpy(dtype=object),
+                    allow_pickle=True)
+        elif kind == 'text':
+            missing = values.isna().to_numpy()
+            np.save(os.path.join(tmp_entry, f'{i}.npy'), values.fillna('').to_numpy().astype(str))
+            np.save(os.path.join(tmp_entry, f'{i}.missing.npy'), missing)
+        else:
+            np.save(os.path.join(tmp_entry, f'{i}.npy'), values.to_numpy(dtype=object), allow_pickle=True)
+        columns.append({'name': name, 'kind': kind})
+
+    meta['columns'] = columns
+    meta['default_index'] = data.index.equals(pd.RangeIndex(len(data)))
+    if not meta['default_index']:
+        np.save(os.path.join(tmp_entry, 'index.npy'), data.index.to_numpy(), allow_pickle=True)
+    with open(os.path.join(tmp_entry, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+    shutil.rmtree(entry, ignore_errors=True)
+    os.replace(tmp_entry, entry)
+
+
+def _load_frame(entry: str, meta: dict) -> pd.DataFrame:
+    data = {}
+    for i, column in enumerate(meta['columns']):
+        path = os.path.join(entry, f'{i}.npy')
+        if column['kind'] == 'array':
+            values = np.load(path, mmap_mode='r')
+        elif column['kind'] == 'category':
+            categories = np.load(os.path.join(entry, f'{i}.categories.npy'), allow_pickle=True)
+            data[i] = pd.Series(pd.Categorical.from_codes(np.load(path), categories))
+            continue
+        elif column['kind'] == 'text':
+            values = np.load(path, mmap_mode='r').astype(object)
+            values[np.load(os.path.join(entry, f'{i}.missing.npy'))] = np.nan
+        else:
+            values = np.load(path, allow_pickle=True)
+        # Object columns stay object; letting pandas infer would turn e.g. Timestamp objects into datetime64
+        data[i] = pd.Series(values, dtype=None if column['kind'] == 'array' else object)
+    frame = pd.DataFrame(data)
+    frame.columns = [column['name'] for column in meta['columns']]
+    if not meta['default_index']:
+        frame.index = np.load(os.path.join(entry, 'index.npy'), allow_pickle=True)
+    return frame
+
+
+def _column_kind(values: pd.Series) -> str:
+    if isinstance(values.dtype, np.dtype) and values.dtype.kind in 'biufcmM':
+        return 'array'
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return 'category'
+    non_missing = values.dropna()
+    if len(non_missing) and all(isinstance(v, str) for v in non_missing):
+        return 'text'
+    return 'object'